@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 from datetime import timedelta
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -126,6 +126,11 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+# Отдача медиафайлов самим Django с заголовками immutable-кэширования (в продакшене - веб-сервером)
+MEDIA_SERVE = config('MEDIA_SERVE', default=DEBUG, cast=bool)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -145,6 +150,65 @@ REST_FRAMEWORK = {
     ]
 }
 
+# Настройки приблизительного подсчета записей в пагинации:
+# начиная с этого числа строк в PostgreSQL используется оценка планировщика вместо COUNT(*)
+PAGINATION_APPROXIMATE_COUNT_THRESHOLD = config('PAGINATION_APPROXIMATE_COUNT_THRESHOLD', default=10000, cast=int)
+# Время кэширования больших значений счетчика в секундах
+PAGINATION_COUNT_CACHE_TIMEOUT = config('PAGINATION_COUNT_CACHE_TIMEOUT', default=60, cast=int)
+
+# Кэш Django: по умолчанию в памяти процесса, для нескольких процессов укажите общий backend
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='education'),
+    }
+}
+
+# Время жизни закэшированных ответов курсов и уроков в секундах
+RESPONSE_CACHE_TIMEOUT = config('RESPONSE_CACHE_TIMEOUT', default=300, cast=int)
+
+# Заголовок Idempotency-Key: время хранения первого ответа в секундах (старые ключи удаляет purge_idempotency_keys)
+IDEMPOTENCY_KEY_TIMEOUT = config('IDEMPOTENCY_KEY_TIMEOUT', default=86400, cast=int)
+
+# Домены, ссылки на которые допускаются в названиях и описаниях курсов и уроков (вместе с поддоменами)
+LINK_VALIDATOR_ALLOWED_DOMAINS = config('LINK_VALIDATOR_ALLOWED_DOMAINS', default='youtube.com,youtu.be', cast=Csv())
+
+# Почта: по умолчанию письма выводятся в консоль, для SMTP - EMAIL_BACKEND=django.core.mail.backends.smtp.EmailBackend
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='noreply@localhost')
+
+# Уведомления подписчиков: задержка рассылки после последнего изменения курса (секунды) и размер пачки писем
+COURSE_NOTIFICATION_DELAY = config('COURSE_NOTIFICATION_DELAY', default=60, cast=int)
+COURSE_NOTIFICATION_BATCH_SIZE = config('COURSE_NOTIFICATION_BATCH_SIZE', default=500, cast=int)
+# Наибольшая задержка рассылки от создания задания (секунды): частые изменения курса не откладывают ее бесконечно
+COURSE_NOTIFICATION_MAX_DELAY = config('COURSE_NOTIFICATION_MAX_DELAY', default=600, cast=int)
+# Время, после которого задание в обработке считается брошенным и захватывается повторно (секунды)
+COURSE_NOTIFICATION_CLAIM_TIMEOUT = config('COURSE_NOTIFICATION_CLAIM_TIMEOUT', default=600, cast=int)
+# Количество попыток рассылки и пауза перед повтором после ошибки, растущая с каждой попыткой (секунды)
+COURSE_NOTIFICATION_MAX_ATTEMPTS = config('COURSE_NOTIFICATION_MAX_ATTEMPTS', default=3, cast=int)
+COURSE_NOTIFICATION_RETRY_DELAY = config('COURSE_NOTIFICATION_RETRY_DELAY', default=60, cast=int)
+
+# Каталог сжатых файлов архива старых платежей (команда archive_payments)
+PAYMENT_ARCHIVE_DIR = config('PAYMENT_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+
+# Количество последних платежей в профиле пользователя, полная история - постранично в user/payments/
+USER_RECENT_PAYMENTS_COUNT = config('USER_RECENT_PAYMENTS_COUNT', default=10, cast=int)
+
+# Уменьшенные копии изображений: имя копии -> максимальный размер (ширина, высота)
+IMAGE_RENDITIONS = {
+    'thumb': (160, 160),
+    'medium': (640, 640),
+}
+IMAGE_RENDITIONS_QUALITY = config('IMAGE_RENDITIONS_QUALITY', default=80, cast=int)
+# Копии создаются в пуле процессов после фиксации транзакции; False - синхронно (для тестов)
+IMAGE_RENDITIONS_ASYNC = config('IMAGE_RENDITIONS_ASYNC', default=True, cast=bool)
+IMAGE_RENDITIONS_WORKERS = config('IMAGE_RENDITIONS_WORKERS', default=2, cast=int)
+
 # Настройки срока действия токенов
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=15),
@@ -14,11 +14,17 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from main.storage import serve_immutable_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('main.urls', namespace='courses')),
     path('user/', include('users.urls', namespace='users'))
 ]
+
+if settings.MEDIA_SERVE:
+    urlpatterns.append(re_path(rf'^{settings.MEDIA_URL.lstrip("/")}(?P<path>.*)$', serve_immutable_media, name='media'))
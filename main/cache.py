@@ -0,0 +1,112 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from users.models import UserRoles
+
+CACHE_PREFIX = 'education:response'
+MODERATORS_SCOPE = 'moderators'
+GLOBAL_SCOPE = 'global'
+HITS_KEY = f'{CACHE_PREFIX}:hits'
+MISSES_KEY = f'{CACHE_PREFIX}:misses'
+
+
+def get_user_scope(user_id):
+    """ Область кэша пользователя: его собственные курсы, уроки и подписки """
+
+    return f'user:{user_id}'
+
+
+def _get_version_key(scope):
+    return f'{CACHE_PREFIX}:version:{scope}'
+
+
+def get_scope_version(scope):
+    """
+    Текущая версия области кэша. Новая версия начинается с текущего времени,
+    чтобы после вытеснения ключа версии из кэша не вернуться к старым ответам
+    """
+
+    key = _get_version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _increment_versions(scopes):
+    for scope in scopes:
+        key = _get_version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def invalidate_scopes(*scopes):
+    """
+    Сброс закэшированных ответов указанных областей сменой их версий после фиксации текущей транзакции:
+    иначе параллельный запрос успеет закэшировать под новой версией еще не зафиксированные данные
+    """
+
+    scopes = set(scopes)
+    transaction.on_commit(lambda: _increment_versions(scopes))
+
+
+def invalidate_users(*user_ids):
+    """ Сброс кэша пользователей и модераторов, которые видят все объекты """
+
+    invalidate_scopes(MODERATORS_SCOPE, *(get_user_scope(user_id) for user_id in user_ids if user_id is not None))
+
+
+def invalidate_all():
+    """ Сброс всех закэшированных ответов (массовые операции, после которых затронутых владельцев не узнать) """
+
+    invalidate_scopes(GLOBAL_SCOPE)
+
+
+def get_request_scopes(request):
+    """ Области кэша, от которых зависит ответ: модераторам видны объекты всех пользователей """
+
+    scopes = [GLOBAL_SCOPE, get_user_scope(request.user.pk)]
+    if request.user.role == UserRoles.MODERATOR:
+        scopes.append(MODERATORS_SCOPE)
+    return scopes
+
+
+def get_response_cache_key(request):
+    """ Ключ ответа: пользователь, версии его областей кэша и полный путь запроса """
+
+    versions = ':'.join(str(get_scope_version(scope)) for scope in get_request_scopes(request))
+    path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'{CACHE_PREFIX}:{request.user.pk}:{versions}:{path_hash}'
+
+
+def _increment_counter(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def record_hit():
+    _increment_counter(HITS_KEY)
+
+
+def record_miss():
+    _increment_counter(MISSES_KEY)
+
+
+def get_cache_stats():
+    """ Счетчики попаданий и промахов кэша ответов """
+
+    return {
+        'hits': cache.get(HITS_KEY, 0),
+        'misses': cache.get(MISSES_KEY, 0),
+    }
+
@@ -0,0 +1,14 @@
+from django_filters import rest_framework as filters
+
+from main.models import PaymentDailyRollup
+
+
+class PaymentRevenueFilter(filters.FilterSet):
+    """ Фильтр дневных итогов платежей по периоду, курсу, уроку и способу оплаты """
+
+    date_from = filters.DateFilter(field_name='date', lookup_expr='gte')
+    date_to = filters.DateFilter(field_name='date', lookup_expr='lte')
+
+    class Meta:
+        model = PaymentDailyRollup
+        fields = ('course', 'lesson', 'payment_method')
@@ -0,0 +1,138 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS_CACHE_PREFIX = 'education:renditions'
+
+_executor = None
+
+
+def get_rendition_name(name, rendition):
+    """ Имя файла уменьшенной копии рядом с оригиналом: main/course/photo.jpg -> main/course/photo_thumb.webp """
+
+    base, _ = os.path.splitext(name)
+    return f'{base}_{rendition}.webp'
+
+
+def render_image(source_path, targets, quality):
+    """
+    Создание уменьшенных копий изображения в формате WebP.
+    Выполняется в отдельном процессе, поэтому работает только с путями файлов и не обращается к Django
+    """
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        for target_path, size in targets:
+            rendition = image.copy()
+            rendition.thumbnail(size)
+            rendition.save(target_path, 'WEBP', quality=quality)
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_RENDITIONS_WORKERS)
+    return _executor
+
+
+def _get_ready_key(name):
+    return f'{RENDITIONS_CACHE_PREFIX}:{name}'
+
+
+def schedule_renditions(field_file):
+    """ Постановка создания уменьшенных копий файла в пул процессов (или синхронно, если это отключено) """
+
+    storage = field_file.storage
+    name = field_file.name
+    ready = []
+    targets = []
+    for rendition, size in settings.IMAGE_RENDITIONS.items():
+        rendition_name = get_rendition_name(name, rendition)
+        # Одинаковые изображения хранятся в одном файле, поэтому готовые копии повторно не создаются
+        if storage.exists(rendition_name):
+            ready.append(rendition)
+        else:
+            targets.append((storage.path(rendition_name), tuple(size)))
+    if not targets:
+        mark_renditions_ready(name, ready)
+        return
+    renditions = list(settings.IMAGE_RENDITIONS)
+    args = (storage.path(name), targets, settings.IMAGE_RENDITIONS_QUALITY)
+    if settings.IMAGE_RENDITIONS_ASYNC:
+        future = get_executor().submit(render_image, *args)
+        future.add_done_callback(lambda future: finish_renditions(name, renditions, ready, future.exception()))
+    else:
+        try:
+            render_image(*args)
+        except Exception as error:
+            finish_renditions(name, renditions, ready, error)
+        else:
+            finish_renditions(name, renditions, ready, None)
+
+
+def finish_renditions(name, renditions, ready, error):
+    """
+    Отметка созданных копий. Ошибки создания копий не должны прерывать запрос, но и теряться тоже не должны:
+    при ошибке готовыми остаются только копии, существовавшие до нее
+    """
+
+    if error is None:
+        mark_renditions_ready(name, renditions)
+    else:
+        logger.error('Не удалось создать уменьшенные копии изображения %s', name, exc_info=error)
+        mark_renditions_ready(name, ready)
+
+
+def mark_renditions_ready(name, renditions):
+    """ Готовые копии изображения запоминаются в кэше, чтобы при выводе не проверять файлы в хранилище """
+
+    cache.set(_get_ready_key(name), list(renditions), None)
+
+
+def get_rendition_urls(field_file):
+    """
+    URL уменьшенных копий изображения или None, если изображение не загружено.
+    Пока копия не отмечена готовой (не создана, ее не удалось создать или отметка вытеснена из кэша),
+    вместо нее отдается URL оригинала
+    """
+
+    if not field_file:
+        return None
+    storage = field_file.storage
+    ready = cache.get(_get_ready_key(field_file.name), ())
+    urls = {}
+    for rendition in settings.IMAGE_RENDITIONS:
+        rendition_name = get_rendition_name(field_file.name, rendition)
+        urls[rendition] = storage.url(rendition_name if rendition in ready else field_file.name)
+    return urls
+
+
+def register_image_renditions(model, *field_names):
+    """ Подключение создания уменьшенных копий после сохранения новых изображений в полях модели """
+
+    def remember_images(sender, instance, **kwargs):
+        instance._rendition_sources = {name: instance.__dict__.get(name) for name in field_names}
+
+    def render_changed_images(sender, instance, raw=False, **kwargs):
+        if raw:
+            return
+        for name in field_names:
+            field_file = getattr(instance, name)
+            previous = instance._rendition_sources.get(name)
+            previous_name = getattr(previous, 'name', previous)
+            if field_file and field_file.name != previous_name:
+                transaction.on_commit(lambda field_file=field_file: schedule_renditions(field_file))
+        instance._rendition_sources = {name: getattr(instance, name).name for name in field_names}
+
+    post_init.connect(remember_images, sender=model, weak=False)
+    post_save.connect(render_changed_images, sender=model, weak=False)
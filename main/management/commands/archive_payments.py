@@ -0,0 +1,122 @@
+import datetime
+import gzip
+import json
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.utils import timezone
+
+from main.models import Payment
+from main.partitions import add_months, get_partitions, is_partitioned
+
+ARCHIVE_FIELDS = {
+    'id': 'id',
+    'payment_date': 'payment_date',
+    'amount': 'amount',
+    'payment_method': 'payment_method',
+    'course_id': 'course_id',
+    'lesson_id': 'lesson_id',
+    'owner_id': 'owner_id',
+    'course': 'course__name',
+    'lesson': 'lesson__name',
+    'owner': 'owner__email',
+}
+
+
+class Command(BaseCommand):
+    """
+    Команда для переноса старых платежей в сжатые файлы NDJSON по месяцам (payments-2023-10.ndjson.gz).
+    Платежи удаляются без сигналов, поэтому дневные итоги платежей и выручка за прошлые периоды сохраняются
+    """
+
+    help = 'Архивирует платежи раньше указанной даты в файлы .ndjson.gz и удаляет их из БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, type=datetime.date.fromisoformat,
+                            help='Дата ГГГГ-ММ-ДД: архивируются платежи раньше ее начала')
+        parser.add_argument('--output-dir', default=settings.PAYMENT_ARCHIVE_DIR, help='Каталог файлов архива')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество платежей в одной пачке')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.make_aware(datetime.datetime.combine(options['before'], datetime.time.min))
+        if cutoff > timezone.now():
+            raise CommandError('Нельзя архивировать платежи будущих периодов')
+        os.makedirs(options['output_dir'], exist_ok=True)
+
+        payments = Payment.objects.filter(payment_date__lt=cutoff).order_by('pk').values_list(*ARCHIVE_FIELDS.values())
+        names = list(ARCHIVE_FIELDS)
+        files = {}
+        archived = 0
+        last_id = 0
+        try:
+            while True:
+                rows = list(payments.filter(pk__gt=last_id)[:options['batch_size']])
+                if not rows:
+                    break
+                for row in rows:
+                    record = dict(zip(names, row))
+                    archive = self.get_archive(files, options['output_dir'], record['payment_date'])
+                    archive.write(json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+                # Платежи удаляются только после записи пачки на диск
+                for archive in files.values():
+                    archive.flush()
+                    os.fsync(archive.fileno())
+                ids = [row[0] for row in rows]
+                self.delete_payments(ids)
+                archived += len(ids)
+                last_id = ids[-1]
+        finally:
+            for archive in files.values():
+                archive.close()
+
+        dropped = self.drop_empty_partitions(cutoff)
+        self.stdout.write(self.style.SUCCESS(
+            f'Архивировано платежей: {archived}, файлов: {len(files)}, удалено секций: {dropped}'
+        ))
+
+    @staticmethod
+    def delete_payments(ids):
+        """
+        Удаление пачки платежей одним запросом в обход QuerySet.delete():
+        сигналы post_delete вычли бы архивируемые платежи из дневных итогов
+        """
+
+        quote_name = connection.ops.quote_name
+        placeholders = ', '.join(['%s'] * len(ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote_name(Payment._meta.db_table)} '
+                f'WHERE {quote_name(Payment._meta.pk.column)} IN ({placeholders})',
+                ids,
+            )
+
+    @staticmethod
+    def get_archive(files, output_dir, payment_date):
+        month = timezone.localtime(payment_date).strftime('%Y-%m')
+        if month not in files:
+            # Повторный запуск дописывает в файл новый член gzip, такой файл читается как единый поток
+            files[month] = gzip.open(os.path.join(output_dir, f'payments-{month}.ndjson.gz'), 'at', encoding='utf-8')
+        return files[month]
+
+    @staticmethod
+    def drop_empty_partitions(cutoff):
+        """ Удаление опустевших месячных секций PostgreSQL, целиком лежащих раньше даты архивации """
+
+        if not is_partitioned(connection):
+            return 0
+        quote_name = connection.ops.quote_name
+        dropped = 0
+        with connection.cursor() as cursor:
+            for month, name in sorted(get_partitions(connection).items()):
+                partition_end = datetime.datetime.combine(add_months(month, 1), datetime.time.min,
+                                                          datetime.timezone.utc)
+                if partition_end > cutoff:
+                    continue
+                cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {quote_name(name)})')
+                if not cursor.fetchone()[0]:
+                    cursor.execute(f'DROP TABLE {quote_name(name)}')
+                    dropped += 1
+        return dropped
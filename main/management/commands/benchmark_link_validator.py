@@ -0,0 +1,56 @@
+import random
+import re
+import string
+import time
+
+from django.core.management import BaseCommand
+
+from main.validators import LinkValidator
+
+
+def legacy_has_external_links(text):
+    """ Прежняя реализация LinkValidator.has_external_links для сравнения """
+
+    urls = re.findall(r'(?:https?://|www\.)?([^\s./?#]+)(?:\.[^\s./?#]+)', text)
+    for url in urls:
+        if 'youtube' not in url:
+            return True
+    return False
+
+
+class Command(BaseCommand):
+    """Команда для замера пропускной способности проверки ссылок на больших описаниях"""
+
+    help = 'Сравнивает скорость прежней и текущей реализации LinkValidator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=256, help='Размер одного описания в килобайтах')
+        parser.add_argument('--texts', type=int, default=20, help='Количество описаний')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов замера')
+
+    def handle(self, *args, **options):
+        texts = [self.make_description(options['size'] * 1024) for _ in range(options['texts'])]
+        total_mb = sum(len(text) for text in texts) * options['repeat'] / 1024 / 1024
+        validator = LinkValidator(fields=['description'])
+
+        for title, check in (('legacy', legacy_has_external_links), ('current', validator.has_external_links)):
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                for text in texts:
+                    check(text)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{title:>8}: {elapsed:.3f} s, {total_mb / elapsed:.1f} MB/s')
+
+    @staticmethod
+    def make_description(size):
+        """ Текст из слов и разрешенных ссылок: худший случай, когда проверяется весь текст """
+
+        words = [''.join(random.choices(string.ascii_lowercase, k=random.randint(2, 10))) for _ in range(500)]
+        links = ['https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube.com/embed/dQw4w9WgXcQ', 'm.youtube.com']
+        parts = []
+        length = 0
+        while length < size:
+            part = random.choice(links) if random.random() < 0.05 else random.choice(words)
+            parts.append(part)
+            length += len(part) + 1
+        return ' '.join(parts)
@@ -0,0 +1,26 @@
+import datetime
+
+from django.core.management import BaseCommand
+from django.db import connection
+
+from main.partitions import add_months, create_partition, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    """Команда для создания месячных секций таблицы платежей наперед (запускается по расписанию)"""
+
+    help = 'Создает секции таблицы платежей на текущий и следующие месяцы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3, help='На сколько месяцев вперед создавать секции')
+
+    def handle(self, *args, **options):
+        if not is_partitioned(connection):
+            self.stdout.write('Таблица платежей не секционирована, секции не нужны')
+            return
+
+        month = month_start(datetime.date.today())
+        for offset in range(options['months'] + 1):
+            create_partition(connection, add_months(month, offset))
+
+        self.stdout.write(self.style.SUCCESS(f'Секции созданы до {add_months(month, options["months"])}'))
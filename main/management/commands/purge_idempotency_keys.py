@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from main.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    """Команда для удаления ключей Idempotency-Key с истекшим сроком хранения ответа"""
+
+    help = 'Удаляет сохраненные ответы на запросы с Idempotency-Key старше IDEMPOTENCY_KEY_TIMEOUT секунд'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество ключей в одном DELETE')
+
+    def handle(self, *args, **options):
+        expired = IdempotencyKey.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TIMEOUT),
+        )
+        deleted = 0
+        while ids := list(expired.values_list('pk', flat=True)[:options['batch_size']]):
+            deleted += IdempotencyKey.objects.filter(pk__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей: {deleted}'))
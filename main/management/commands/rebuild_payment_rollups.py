@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from main.models import PaymentDailyRollup
+
+
+class Command(BaseCommand):
+    """Команда для полного пересчета дневных итогов платежей"""
+
+    help = 'Пересчитывает дневные итоги платежей по платежам в БД, итоги архивированных периодов сохраняются'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество строк итогов в одном INSERT')
+
+    def handle(self, *args, **options):
+        created = PaymentDailyRollup.objects.rebuild(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Создано строк итогов: {created}'))
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+
+from main.models import Course
+
+
+class Command(BaseCommand):
+    """Команда для пересчета сохраненного счетчика уроков курсов пачками"""
+
+    help = 'Пересчитывает поле lessons_count у курсов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество курсов в одном UPDATE')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        course_ids = Course.objects.order_by('pk').values_list('pk', flat=True)
+
+        updated = 0
+        last_id = 0
+        while True:
+            batch = list(course_ids.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            updated += Course.objects.filter(pk__in=batch).recount_lessons()
+            last_id = batch[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано курсов: {updated}'))
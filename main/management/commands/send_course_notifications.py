@@ -0,0 +1,26 @@
+import time
+
+from django.core.management import BaseCommand
+
+from main.notifications import process_due_notifications
+
+
+class Command(BaseCommand):
+    """Обработчик очереди уведомлений подписчиков об обновлении курсов"""
+
+    help = 'Рассылает подписчикам уведомления об обновлении курсов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Обработать наступившие задания и завершиться')
+        parser.add_argument('--interval', type=float, default=5, help='Пауза между проверками очереди, секунды')
+        parser.add_argument('--limit', type=int, default=100, help='Количество заданий за одну проверку')
+
+    def handle(self, *args, **options):
+        while True:
+            notifications, sent = process_due_notifications(options['limit'])
+            if notifications:
+                self.stdout.write(f'Обработано заданий: {notifications}, отправлено писем: {sent}')
+            if options['once']:
+                break
+            if notifications < options['limit']:
+                time.sleep(options['interval'])
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.5 on 2023-10-12 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_subscription'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='course',
+            old_name='course_name',
+            new_name='name',
+        ),
+        migrations.RenameField(
+            model_name='course',
+            old_name='course_preview',
+            new_name='preview',
+        ),
+        migrations.RenameField(
+            model_name='course',
+            old_name='course_description',
+            new_name='description',
+        ),
+        migrations.RenameField(
+            model_name='lesson',
+            old_name='lesson_name',
+            new_name='name',
+        ),
+        migrations.RenameField(
+            model_name='lesson',
+            old_name='lesson_description',
+            new_name='description',
+        ),
+        migrations.RenameField(
+            model_name='lesson',
+            old_name='lesson_preview',
+            new_name='preview',
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='название урока'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='description',
+            field=models.TextField(verbose_name='описание урока'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='preview',
+            field=models.ImageField(blank=True, null=True, upload_to='lessons/', verbose_name='изображение урока'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='video_url',
+            field=models.URLField(blank=True, null=True, verbose_name='ссылка на видео урока'),
+        ),
+        migrations.RenameField(
+            model_name='payment',
+            old_name='date',
+            new_name='payment_date',
+        ),
+        migrations.RenameField(
+            model_name='payment',
+            old_name='method',
+            new_name='payment_method',
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.5 on 2023-10-12 10:30
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+BATCH_SIZE = 1000
+
+
+def fill_lessons_count(apps, schema_editor):
+    Course = apps.get_model('main', 'Course')
+    Lesson = apps.get_model('main', 'Lesson')
+    db_alias = schema_editor.connection.alias
+
+    lessons_count = Lesson.objects.using(db_alias).filter(course=OuterRef('pk')).order_by().values('course').annotate(
+        count=Count('pk'),
+    ).values('count')
+    course_ids = Course.objects.using(db_alias).order_by('pk').values_list('pk', flat=True)
+
+    last_id = 0
+    while True:
+        batch = list(course_ids.filter(pk__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        Course.objects.using(db_alias).filter(pk__in=batch).update(
+            lessons_count=Coalesce(Subquery(lessons_count), 0),
+        )
+        last_id = batch[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_sync_field_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='lessons_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='количество уроков'),
+        ),
+        migrations.RunPython(fill_lessons_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.5 on 2023-10-13 12:05
+
+import hashlib
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def make_content_hash(name, description):
+    return hashlib.sha256(f'{name}\0{description}'.encode()).hexdigest()
+
+
+def fill_content_hash(apps, schema_editor):
+    db_alias = schema_editor.connection.alias
+    for model_name in ('Course', 'Lesson'):
+        model = apps.get_model('main', model_name)
+        objects = model.objects.using(db_alias).order_by('pk').only('pk', 'name', 'description')
+
+        last_id = 0
+        while True:
+            batch = list(objects.filter(pk__gt=last_id)[:BATCH_SIZE])
+            if not batch:
+                break
+            for obj in batch:
+                obj.content_hash = make_content_hash(obj.name, obj.description)
+            model.objects.using(db_alias).bulk_update(batch, ['content_hash'])
+            last_id = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_course_updated_at_lesson_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='course',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='хэш названия и описания'),
+        ),
+        migrations.AddField(
+            model_name='lesson',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, null=True, verbose_name='хэш названия и описания'),
+        ),
+        migrations.RunPython(fill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.5 on 2023-10-13 12:10
+
+from django.db import migrations, models
+from django.db.models import Count
+
+# Сколько групп повторов показывать в сообщении об ошибке
+REPORT_LIMIT = 20
+
+
+def check_duplicate_content(apps, schema_editor):
+    # Раньше уникальность проверялась только сериализатором, через админку или ORM могли появиться повторы.
+    # Объединять их автоматически нельзя (на курсы и уроки ссылаются платежи и подписки), поэтому
+    # миграция останавливается до добавления ограничений и перечисляет повторяющиеся записи
+    db_alias = schema_editor.connection.alias
+    report = []
+    for model_name in ('Course', 'Lesson'):
+        model = apps.get_model('main', model_name)
+        objects = model.objects.using(db_alias)
+        hashes = objects.order_by().values('content_hash').annotate(count=Count('pk')).filter(count__gt=1)
+        for group in hashes.order_by('content_hash')[:REPORT_LIMIT]:
+            ids = objects.filter(content_hash=group['content_hash']).order_by('pk').values_list('pk', flat=True)
+            report.append(f'{model_name}: id {", ".join(map(str, ids))}')
+    if report:
+        raise RuntimeError(
+            'Найдены курсы или уроки с одинаковыми названием и описанием, уникальные ограничения не добавлены. '
+            'Измените или удалите повторы и повторите миграцию:\n' + '\n'.join(report)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_course_content_hash_lesson_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_content, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='course',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, verbose_name='хэш названия и описания'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='content_hash',
+            field=models.CharField(editable=False, max_length=64, verbose_name='хэш названия и описания'),
+        ),
+        migrations.AddConstraint(
+            model_name='course',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='course_unique_name_description'),
+        ),
+        migrations.AddConstraint(
+            model_name='lesson',
+            constraint=models.UniqueConstraint(fields=('content_hash',), name='lesson_unique_name_description'),
+        ),
+    ]
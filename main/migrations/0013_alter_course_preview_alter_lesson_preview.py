@@ -0,0 +1,24 @@
+# Generated by Django 4.2.5 on 2023-10-19 12:10
+
+from django.db import migrations, models
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_content_hash_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='course',
+            name='preview',
+            field=models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='main/course/', verbose_name='Превью'),
+        ),
+        migrations.AlterField(
+            model_name='lesson',
+            name='preview',
+            field=models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='lessons/', verbose_name='изображение урока'),
+        ),
+    ]
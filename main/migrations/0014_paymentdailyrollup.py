@@ -0,0 +1,57 @@
+# Generated by Django 4.2.5 on 2023-10-20 11:05
+
+from itertools import islice
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def fill_payment_rollups(apps, schema_editor):
+    Payment = apps.get_model('main', 'Payment')
+    PaymentDailyRollup = apps.get_model('main', 'PaymentDailyRollup')
+    db_alias = schema_editor.connection.alias
+
+    groups = Payment.objects.using(db_alias).annotate(date=TruncDate('payment_date')).order_by().values(
+        'date', 'course_id', 'lesson_id', 'payment_method',
+    ).annotate(total_amount=Sum('amount'), payments_count=Count('pk'))
+    rollups = (
+        PaymentDailyRollup(
+            date=group['date'], course_id=group['course_id'], lesson_id=group['lesson_id'],
+            payment_method=group['payment_method'], amount=group['total_amount'], count=group['payments_count'],
+        )
+        for group in groups.iterator(chunk_size=BATCH_SIZE)
+    )
+    while batch := list(islice(rollups, BATCH_SIZE)):
+        PaymentDailyRollup.objects.using(db_alias).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_alter_course_preview_alter_lesson_preview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='дата')),
+                ('payment_method', models.CharField(choices=[('CASH', 'Наличные'), ('TRANSFER', 'Перевод на счет')], max_length=25, verbose_name='способ оплаты')),
+                ('amount', models.BigIntegerField(default=0, verbose_name='сумма платежей')),
+                ('count', models.IntegerField(default=0, verbose_name='количество платежей')),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.course', verbose_name='курс')),
+                ('lesson', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='main.lesson', verbose_name='урок')),
+            ],
+            options={
+                'verbose_name': 'итог платежей за день',
+                'verbose_name_plural': 'итоги платежей за день',
+                'indexes': [models.Index(fields=['date', 'course', 'lesson', 'payment_method'], name='payment_rollup_group_idx')],
+            },
+        ),
+        migrations.RunPython(fill_payment_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.5 on 2023-10-20 14:40
+
+from django.db import migrations, models
+
+from main.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY в PostgreSQL нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('main', '0014_paymentdailyrollup'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['owner', '-payment_date', '-id'], name='payment_owner_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['course', '-payment_date', '-id'], name='payment_course_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['lesson', '-payment_date', '-id'], name='payment_lesson_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['payment_method', '-payment_date', '-id'], name='payment_method_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['-payment_date', '-id'], name='payment_date_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2023-10-21 10:15
+
+from django.db import migrations
+
+from main.partitions import rebuild_table
+
+
+def partition_payments(apps, schema_editor):
+    # Секционирование есть только в PostgreSQL, в остальных СУБД таблица платежей остается обычной
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_table(schema_editor, partitioned=True)
+
+
+def unpartition_payments(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        rebuild_table(schema_editor, partitioned=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_payment_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_payments, unpartition_payments),
+    ]
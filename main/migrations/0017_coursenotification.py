@@ -0,0 +1,37 @@
+# Generated by Django 4.2.5 on 2023-10-22 09:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_partition_payments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('processing', 'Выполняется'), ('done', 'Выполнено'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='статус')),
+                ('changes_count', models.PositiveIntegerField(default=1, verbose_name='количество объединенных изменений')),
+                ('scheduled_at', models.DateTimeField(verbose_name='время рассылки')),
+                ('sent_count', models.PositiveIntegerField(default=0, verbose_name='отправлено писем')),
+                ('error', models.TextField(blank=True, verbose_name='ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='дата создания')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='дата выполнения')),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.course', verbose_name='курс')),
+            ],
+            options={
+                'verbose_name': 'уведомление об обновлении курса',
+                'verbose_name_plural': 'уведомления об обновлении курсов',
+                'indexes': [models.Index(fields=['status', 'scheduled_at'], name='course_notification_due_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='coursenotification',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('course',), name='course_notification_one_pending'),
+        ),
+    ]
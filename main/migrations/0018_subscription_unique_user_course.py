@@ -0,0 +1,29 @@
+# Generated by Django 4.2.5 on 2023-10-23 10:40
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def remove_duplicate_subscriptions(apps, schema_editor):
+    # Из повторяющихся подписок пользователя на курс оставляем последнюю: ее статус самый актуальный
+    Subscription = apps.get_model('main', 'Subscription')
+    db_alias = schema_editor.connection.alias
+
+    subscriptions = Subscription.objects.using(db_alias).filter(course__isnull=False)
+    last_ids = subscriptions.order_by().values('user_id', 'course_id').annotate(last_id=Max('pk')).values('last_id')
+    subscriptions.exclude(pk__in=last_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0017_coursenotification'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_subscriptions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'course'), name='subscription_unique_user_course'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2023-10-25 12:10
+
+from django.db import migrations, models
+
+from main.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY в PostgreSQL нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('main', '0018_subscription_unique_user_course'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='subscription',
+            index=models.Index(fields=['user', 'is_subscribed'], name='subscription_user_status_idx'),
+        ),
+    ]
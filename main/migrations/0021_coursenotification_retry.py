@@ -0,0 +1,28 @@
+# Generated by Django 4.2.5 on 2023-10-27 10:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0020_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursenotification',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='количество попыток'),
+        ),
+        migrations.AddField(
+            model_name='coursenotification',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='дата захвата'),
+        ),
+        migrations.AddField(
+            model_name='coursenotification',
+            name='last_email',
+            field=models.CharField(blank=True, max_length=254, verbose_name='последний получатель'),
+        ),
+    ]
@@ -0,0 +1,185 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from main.cache import get_request_scopes, get_response_cache_key, get_scope_version, record_hit, record_miss
+from main.models import IdempotencyKey
+from users.models import UserRoles
+
+
+class RoleScopedQuerysetMixin:
+    """
+    Миксин для ограничения queryset по роли пользователя: модератор видит все объекты,
+    остальные пользователи - только свои. Колонки и связи подгружаются через setup_eager_loading сериализатора
+    по набору полей, которые он выведет, и текущему запросу
+    """
+
+    owner_field = 'owner'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.role != UserRoles.MODERATOR:
+            queryset = queryset.filter(**{self.owner_field: self.request.user})
+
+        setup_eager_loading = getattr(self.serializer_class, 'setup_eager_loading', None)
+        if setup_eager_loading is not None:
+            queryset = setup_eager_loading(queryset, set(self.get_serializer().fields), self.request)
+        return queryset
+
+
+class CachedResponseMixin:
+    """
+    Миксин для кэширования ответов list и retrieve отдельно для каждого пользователя и общей области модераторов.
+    Кэш сбрасывается сигналами при изменении курсов, уроков и подписок
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        # Ключ вычисляем до чтения данных, чтобы изменения во время запроса не попали под старый ответ
+        cache_key = get_response_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            record_hit()
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        record_miss()
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class ConditionalGetMixin:
+    """
+    Миксин для условных GET-запросов: ETag и Last-Modified вычисляются по агрегатам дат изменения выборки
+    до сериализации, при совпадении валидаторов возвращается 304 Not Modified без тела
+    """
+
+    # Даты изменения, от которых зависит ответ: кроме объекта - связанные объекты, данные которых он выводит
+    last_modified_fields = ('updated_at',)
+    # Last-Modified детали по датам изменения; отключается, если ответ зависит и от других данных пользователя
+    conditional_last_modified = True
+
+    def get_last_modified_expression(self):
+        """ Наибольшая из дат изменения last_modified_fields """
+
+        if len(self.last_modified_fields) > 1:
+            return Greatest(*self.last_modified_fields)
+        return F(self.last_modified_fields[0])
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        aggregates = queryset.aggregate(last_modified=Max(self.get_last_modified_expression()), count=Count('pk'))
+        # Last-Modified для списка не отдаем: по дате нельзя заметить удаление объекта, а ETag учитывает количество
+        etag = self.get_etag(request, aggregates['last_modified'], aggregates['count'])
+        return self.get_conditional_response(super().list, request, etag, None, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        last_modified = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: kwargs[lookup_url_kwarg]}
+        ).values_list(self.get_last_modified_expression(), flat=True).first()
+        if last_modified is None:
+            return super().retrieve(request, *args, **kwargs)
+        etag = self.get_etag(request, last_modified)
+        if not self.conditional_last_modified:
+            last_modified = None
+        return self.get_conditional_response(super().retrieve, request, etag, last_modified, *args, **kwargs)
+
+    @staticmethod
+    def get_etag(request, last_modified, count=None):
+        """ ETag зависит от пути запроса, пользователя, данных выборки и версий его областей кэша (подписки) """
+
+        versions = [get_scope_version(scope) for scope in get_request_scopes(request)]
+        value = f'{request.get_full_path()}:{request.user.pk}:{last_modified}:{count}:{versions}'
+        return f'"{hashlib.md5(value.encode()).hexdigest()}"'
+
+    @staticmethod
+    def get_conditional_response(handler, request, etag, last_modified, *args, **kwargs):
+        last_modified_timestamp = int(last_modified.timestamp()) if last_modified is not None else None
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified_timestamp)
+        if not_modified is not None:
+            return not_modified
+
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+            if last_modified_timestamp is not None:
+                response['Last-Modified'] = http_date(last_modified_timestamp)
+        return response
+
+
+class IdempotencyKeyMixin:
+    """
+    Миксин для повторяемых запросов на создание с заголовком Idempotency-Key: первый успешный ответ хранится
+    в IdempotencyKey по (пользователь, ключ) IDEMPOTENCY_KEY_TIMEOUT секунд и возвращается на повторы
+    без проверки и записи данных. Запись ключа создается в одной транзакции с объектом, поэтому параллельный
+    запрос с тем же ключом ждет на уникальном индексе БД (в любом процессе сервера) и получает первый ответ
+    """
+
+    idempotency_header = 'Idempotency-Key'
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError({self.idempotency_header: ['Ключ не должен быть длиннее 255 символов.']})
+
+        fingerprint = hashlib.md5(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(user=request.user, key=key, fingerprint=fingerprint)
+            except IntegrityError:
+                # Ключ уже использован: запись видна только вместе с зафиксированным ответом
+                record = IdempotencyKey.objects.get(user=request.user, key=key)
+                if record.created_at > timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TIMEOUT):
+                    return self.replay_response(record, fingerprint)
+                # Срок хранения ответа истек: удаляем именно эту запись (ее мог уже заменить другой запрос)
+                IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+                try:
+                    with transaction.atomic():
+                        record = IdempotencyKey.objects.create(user=request.user, key=key, fingerprint=fingerprint)
+                except IntegrityError:
+                    # Истекший ключ успел заменить параллельный повтор запроса: отдаем его ответ
+                    record = IdempotencyKey.objects.filter(user=request.user, key=key).first()
+                    if record is None:
+                        return Response({'detail': 'Запрос с этим Idempotency-Key еще выполняется, повторите его.'},
+                                        status=status.HTTP_409_CONFLICT)
+                    return self.replay_response(record, fingerprint)
+
+            response = super().create(request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                # Ответ с ошибкой не запоминаем: запрос с тем же ключом можно исправить и повторить
+                transaction.set_rollback(True)
+                return response
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=['status_code', 'response'])
+        return response
+
+    @staticmethod
+    def replay_response(record, fingerprint):
+        if record.fingerprint != fingerprint:
+            return Response({'detail': 'Idempotency-Key уже использован для запроса с другими данными.'},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
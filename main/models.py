@@ -1,24 +1,129 @@
+import hashlib
+from itertools import islice
+
 from django.conf import settings
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Now, TruncDate
+from django.utils import timezone
+
+from main.cache import invalidate_all
+from main.storage import content_addressed_storage
 
 from users.models import NULLABLE, User
 
 
+def make_content_hash(name, description):
+    """Хэш пары (name, description): уникальность проверяется по индексу хэша, а не сравнением длинного текста"""
+
+    return hashlib.sha256(f'{name}\0{description}'.encode()).hexdigest()
+
+
+def with_content_hash_field(update_fields):
+    """Добавляем content_hash к update_fields, если сохраняются название или описание"""
+
+    if update_fields is not None and {'name', 'description'} & set(update_fields):
+        return {*update_fields, 'content_hash'}
+    return update_fields
+
+
+class ContentHashQuerySet(models.QuerySet):
+    """QuerySet моделей с content_hash: массовые операции тоже поддерживают хэш в актуальном состоянии"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.content_hash = make_content_hash(obj.name, obj.description)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def update(self, **kwargs):
+        if ('name' not in kwargs and 'description' not in kwargs) or 'content_hash' in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            pks = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            objs = self.model.objects.filter(pk__in=pks).only('pk', 'name', 'description')
+            for obj in objs:
+                obj.content_hash = make_content_hash(obj.name, obj.description)
+            self.model.objects.bulk_update(objs, ['content_hash'], batch_size=1000)
+        return rows
+
+
+class CourseQuerySet(ContentHashQuerySet):
+    """QuerySet курсов"""
+
+    def recount_lessons(self):
+        """Пересчет сохраненного счетчика уроков для курсов выборки одним запросом"""
+
+        lessons_count = Lesson.objects.filter(course=OuterRef('pk')).order_by().values('course').annotate(
+            count=Count('pk'),
+        ).values('count')
+        updated = self.update(lessons_count=Coalesce(Subquery(lessons_count), 0), updated_at=Now())
+        # Массовые изменения уроков идут без сигналов, поэтому сбрасываем весь кэш ответов
+        invalidate_all()
+        return updated
+
+
 class Course(models.Model):
     """Модель курсов"""
     name = models.CharField(max_length=250, verbose_name='Наименование')
-    preview = models.ImageField(upload_to='main/course/', verbose_name='Превью', **NULLABLE)
+    preview = models.ImageField(upload_to='main/course/', storage=content_addressed_storage, verbose_name='Превью',
+                                **NULLABLE)
     description = models.TextField(verbose_name='Описание')
+    # Счетчик уроков поддерживается сигналами и методами LessonQuerySet, вручную не изменяется
+    lessons_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='количество уроков')
+    # Обновляется и при изменении уроков курса, используется для условных GET-запросов
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата изменения')
+    content_hash = models.CharField(max_length=64, editable=False, verbose_name='хэш названия и описания')
 
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='владелец курса',
                               **NULLABLE)
 
+    objects = CourseQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.name}'
 
+    def save(self, *args, **kwargs):
+        # При обновлении курса не перезаписываем счетчик уроков значением, прочитанным до изменения уроков
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            deferred_fields = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'lessons_count' and field.attname not in deferred_fields
+            ]
+        kwargs['update_fields'] = with_content_hash_field(kwargs.get('update_fields'))
+        self.content_hash = make_content_hash(self.name, self.description)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'курс'
         verbose_name_plural = 'курсы'
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'], name='course_unique_name_description'),
+        ]
+
+
+class LessonQuerySet(ContentHashQuerySet):
+    """QuerySet уроков: массовые операции без сигналов пересчитывают счетчик уроков затронутых курсов"""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Course.objects.filter(pk__in={lesson.course_id for lesson in objs}).recount_lessons()
+        return objs
+
+    def update(self, **kwargs):
+        if 'course' not in kwargs and 'course_id' not in kwargs:
+            return super().update(**kwargs)
+        with transaction.atomic(using=self.db):
+            lessons = dict(self.values_list('pk', 'course_id'))
+            rows = super().update(**kwargs)
+            course_ids = set(lessons.values())
+            course_ids.update(self.model.objects.filter(pk__in=lessons).values_list('course_id', flat=True))
+            Course.objects.filter(pk__in=course_ids).recount_lessons()
+        return rows
 
 
 class Lesson(models.Model):
@@ -26,18 +131,31 @@ class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс')
     name = models.CharField(max_length=100, verbose_name='название урока')
     description = models.TextField(verbose_name='описание урока')
-    preview = models.ImageField(upload_to='lessons/', verbose_name='изображение урока', **NULLABLE)
+    preview = models.ImageField(upload_to='lessons/', storage=content_addressed_storage,
+                                verbose_name='изображение урока', **NULLABLE)
     video_url = models.URLField(verbose_name='ссылка на видео урока', **NULLABLE)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='дата изменения')
+    content_hash = models.CharField(max_length=64, editable=False, verbose_name='хэш названия и описания')
 
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='владелец урока',
                               **NULLABLE)
 
+    objects = LessonQuerySet.as_manager()
+
     def __str__(self):
         return f'{self.name}'
 
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = with_content_hash_field(kwargs.get('update_fields'))
+        self.content_hash = make_content_hash(self.name, self.description)
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'урок'
         verbose_name_plural = 'уроки'
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'], name='lesson_unique_name_description'),
+        ]
 
 
 class Payment(models.Model):
@@ -65,6 +183,85 @@ class Payment(models.Model):
     class Meta:
         verbose_name = 'платеж'
         verbose_name_plural = 'платежи'
+        # Индексы под фильтры списка платежей с сортировкой по дате (и курсорной пагинацией по дате и id)
+        indexes = [
+            models.Index(fields=['owner', '-payment_date', '-id'], name='payment_owner_date_idx'),
+            models.Index(fields=['course', '-payment_date', '-id'], name='payment_course_date_idx'),
+            models.Index(fields=['lesson', '-payment_date', '-id'], name='payment_lesson_date_idx'),
+            models.Index(fields=['payment_method', '-payment_date', '-id'], name='payment_method_date_idx'),
+            models.Index(fields=['-payment_date', '-id'], name='payment_date_idx'),
+        ]
+
+
+class PaymentDailyRollupQuerySet(models.QuerySet):
+    """QuerySet дневных итогов платежей"""
+
+    def add_payment(self, date, course_id, lesson_id, payment_method, amount, count=1):
+        """
+        Прибавление платежа (или вычитание при отрицательных amount и count) к итогу дня одним UPDATE.
+        Если строки итога еще нет, она создается; параллельно созданные строки одной группы
+        допустимы - итоги всегда суммируются при выборке
+        """
+
+        group = {'date': date, 'course_id': course_id, 'lesson_id': lesson_id, 'payment_method': payment_method}
+        # Изменяем ровно одну строку группы, даже если их несколько
+        updated = self.filter(pk__in=self.filter(**group).values('pk')[:1]).update(
+            amount=F('amount') + amount,
+            count=F('count') + count,
+        )
+        if not updated:
+            self.create(amount=amount, count=count, **group)
+
+    def rebuild(self, batch_size=1000):
+        """
+        Пересчет итогов по таблице платежей с группировкой на стороне БД. Итоги дней раньше самого старого
+        платежа не трогаем: платежи этих дней перенесены в архив командой archive_payments
+        """
+
+        first_payment_date = Payment.objects.order_by('payment_date').values_list('payment_date', flat=True).first()
+        if first_payment_date is None:
+            return 0
+        since = timezone.localdate(first_payment_date)
+        groups = Payment.objects.annotate(date=TruncDate('payment_date')).order_by().values(
+            'date', 'course_id', 'lesson_id', 'payment_method',
+        ).annotate(total_amount=Sum('amount'), payments_count=Count('pk'))
+        with transaction.atomic(using=self.db):
+            self.filter(date__gte=since).delete()
+            rollups = (
+                self.model(
+                    date=group['date'], course_id=group['course_id'], lesson_id=group['lesson_id'],
+                    payment_method=group['payment_method'], amount=group['total_amount'], count=group['payments_count'],
+                )
+                for group in groups.iterator(chunk_size=batch_size)
+            )
+            created = 0
+            while batch := list(islice(rollups, batch_size)):
+                created += len(self.bulk_create(batch))
+        return created
+
+
+class PaymentDailyRollup(models.Model):
+    """Дневные итоги платежей по курсу, уроку и способу оплаты, поддерживаются сигналами платежей"""
+
+    date = models.DateField(verbose_name='дата')
+    course = models.ForeignKey(Course, on_delete=models.SET_NULL, **NULLABLE, verbose_name='курс')
+    lesson = models.ForeignKey(Lesson, on_delete=models.SET_NULL, **NULLABLE, verbose_name='урок')
+    payment_method = models.CharField(max_length=25, choices=Payment.METHOD_CHOICES, verbose_name='способ оплаты')
+    # Отдельная строка может уйти в минус, если в группе несколько строк: значим только итог по группе
+    amount = models.BigIntegerField(default=0, verbose_name='сумма платежей')
+    count = models.IntegerField(default=0, verbose_name='количество платежей')
+
+    objects = PaymentDailyRollupQuerySet.as_manager()
+
+    def __str__(self):
+        return f'{self.date}: {self.amount}'
+
+    class Meta:
+        verbose_name = 'итог платежей за день'
+        verbose_name_plural = 'итоги платежей за день'
+        indexes = [
+            models.Index(fields=['date', 'course', 'lesson', 'payment_method'], name='payment_rollup_group_idx'),
+        ]
 
 
 class Subscription(models.Model):
@@ -81,3 +278,86 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'course'], name='subscription_unique_user_course'),
+        ]
+        # Индекс под список подписок пользователя с фильтром по статусу
+        indexes = [
+            models.Index(fields=['user', 'is_subscribed'], name='subscription_user_status_idx'),
+        ]
+
+
+class CourseNotification(models.Model):
+    """
+    Задание на рассылку подписчикам курса уведомления об обновлении.
+    Изменения курса до начала рассылки объединяются в одно ожидающее задание
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Ожидает'),
+        (STATUS_PROCESSING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+    )
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, verbose_name='курс')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING, verbose_name='статус')
+    changes_count = models.PositiveIntegerField(default=1, verbose_name='количество объединенных изменений')
+    # Рассылка начинается не раньше этого времени, каждое новое изменение курса его отодвигает
+    scheduled_at = models.DateTimeField(verbose_name='время рассылки')
+    sent_count = models.PositiveIntegerField(default=0, verbose_name='отправлено писем')
+    # Почта последнего получателя отправленной пачки: повторная попытка продолжает рассылку после него
+    last_email = models.CharField(max_length=254, blank=True, verbose_name='последний получатель')
+    # Задание с ошибкой повторяется, пока число попыток меньше COURSE_NOTIFICATION_MAX_ATTEMPTS
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='количество попыток')
+    # Задание, захваченное раньше COURSE_NOTIFICATION_CLAIM_TIMEOUT секунд назад, считается брошенным обработчиком
+    claimed_at = models.DateTimeField(**NULLABLE, verbose_name='дата захвата')
+    error = models.TextField(blank=True, verbose_name='ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='дата создания')
+    processed_at = models.DateTimeField(**NULLABLE, verbose_name='дата выполнения')
+
+    def __str__(self):
+        return f'{self.course_id}: {self.status}'
+
+    class Meta:
+        verbose_name = 'уведомление об обновлении курса'
+        verbose_name_plural = 'уведомления об обновлении курсов'
+        constraints = [
+            models.UniqueConstraint(fields=['course'], condition=models.Q(status='pending'),
+                                    name='course_notification_one_pending'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'scheduled_at'], name='course_notification_due_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ответ на запрос с заголовком Idempotency-Key. Запись создается в одной транзакции с объектом запроса:
+    параллельный запрос с тем же ключом ждет на уникальном индексе фиксации первого и получает его ответ
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name='пользователь')
+    key = models.CharField(max_length=255, verbose_name='ключ')
+    # Хэш тела запроса: повтор ключа с другими данными отклоняется
+    fingerprint = models.CharField(max_length=32, verbose_name='хэш запроса')
+    status_code = models.PositiveSmallIntegerField(**NULLABLE, verbose_name='код ответа')
+    response = models.JSONField(encoder=DjangoJSONEncoder, **NULLABLE, verbose_name='тело ответа')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='дата создания')
+
+    def __str__(self):
+        return f'{self.user_id}: {self.key}'
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique_user_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_key_created_idx'),
+        ]
@@ -0,0 +1,122 @@
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Q, Value
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from main.models import Course, CourseNotification, Subscription
+
+
+def schedule_course_notification(course_id):
+    """
+    Постановка рассылки об обновлении курса в очередь. Если задание на курс еще ожидает рассылки,
+    изменение добавляется к нему, а рассылка откладывается на COURSE_NOTIFICATION_DELAY секунд,
+    но не дальше COURSE_NOTIFICATION_MAX_DELAY секунд от создания задания
+    """
+
+    scheduled_at = timezone.now() + timedelta(seconds=settings.COURSE_NOTIFICATION_DELAY)
+    latest_at = ExpressionWrapper(F('created_at') + timedelta(seconds=settings.COURSE_NOTIFICATION_MAX_DELAY),
+                                  output_field=DateTimeField())
+    pending = CourseNotification.objects.filter(course_id=course_id, status=CourseNotification.STATUS_PENDING)
+    changes = {'scheduled_at': Least(Value(scheduled_at), latest_at), 'changes_count': F('changes_count') + 1}
+    if pending.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            CourseNotification.objects.create(course_id=course_id, scheduled_at=min(
+                scheduled_at, timezone.now() + timedelta(seconds=settings.COURSE_NOTIFICATION_MAX_DELAY),
+            ))
+    except IntegrityError:
+        # Задание успели создать параллельно
+        pending.update(**changes)
+
+
+def claim_due_notifications(limit):
+    """
+    Захват наступивших заданий: параллельные обработчики пропускают строки, заблокированные другими.
+    Кроме ожидающих захватываются задания с ошибкой, у которых остались попытки, и задания,
+    брошенные обработчиком дольше COURSE_NOTIFICATION_CLAIM_TIMEOUT секунд назад
+    """
+
+    now = timezone.now()
+    stale_at = now - timedelta(seconds=settings.COURSE_NOTIFICATION_CLAIM_TIMEOUT)
+    max_attempts = settings.COURSE_NOTIFICATION_MAX_ATTEMPTS
+    with transaction.atomic():
+        # Брошенные задания без оставшихся попыток больше не повторяются
+        CourseNotification.objects.filter(
+            status=CourseNotification.STATUS_PROCESSING, claimed_at__lt=stale_at, attempts__gte=max_attempts,
+        ).update(status=CourseNotification.STATUS_FAILED, error='Обработчик не завершил рассылку', processed_at=now)
+        notifications = list(
+            CourseNotification.objects.select_for_update(skip_locked=True).filter(
+                Q(status=CourseNotification.STATUS_PENDING, scheduled_at__lte=now)
+                | Q(status=CourseNotification.STATUS_FAILED, attempts__lt=max_attempts, scheduled_at__lte=now)
+                | Q(status=CourseNotification.STATUS_PROCESSING, claimed_at__lt=stale_at),
+            ).order_by('scheduled_at')[:limit]
+        )
+        CourseNotification.objects.filter(pk__in=[notification.pk for notification in notifications]).update(
+            status=CourseNotification.STATUS_PROCESSING, claimed_at=now, attempts=F('attempts') + 1,
+        )
+    for notification in notifications:
+        notification.status = CourseNotification.STATUS_PROCESSING
+        notification.claimed_at = now
+        notification.attempts += 1
+    return notifications
+
+
+def get_subscriber_emails(course_id, after=''):
+    """ Почта подписчиков курса по алфавиту начиная после after, читается из БД порциями """
+
+    subscriptions = Subscription.objects.filter(course_id=course_id, is_subscribed=True)
+    if after:
+        subscriptions = subscriptions.filter(user__email__gt=after)
+    return subscriptions.order_by('user__email').values_list('user__email', flat=True).distinct().iterator(
+        chunk_size=settings.COURSE_NOTIFICATION_BATCH_SIZE,
+    )
+
+
+def send_course_notification(notification):
+    """
+    Рассылка уведомления подписчикам пачками по COURSE_NOTIFICATION_BATCH_SIZE писем:
+    каждая пачка отправляется через одно соединение с почтовым сервером, после нее сохраняется
+    последний получатель, чтобы повторная попытка не отправляла письма повторно
+    """
+
+    course_name = Course.objects.filter(pk=notification.course_id).values_list('name', flat=True).first()
+    if course_name is None:
+        # Курс удален вместе с заданием
+        return 0
+    subject = f'Обновление курса «{course_name}»'
+    body = f'В курсе «{course_name}», на который вы подписаны, появились изменения.'
+    emails = get_subscriber_emails(notification.course_id, notification.last_email)
+    # Изменения сохраняются, только пока задание не захвачено повторно другим обработчиком
+    claimed = CourseNotification.objects.filter(pk=notification.pk, claimed_at=notification.claimed_at)
+
+    sent = 0
+    result = {'status': CourseNotification.STATUS_DONE, 'error': ''}
+    try:
+        with get_connection() as connection:
+            while batch := list(islice(emails, settings.COURSE_NOTIFICATION_BATCH_SIZE)):
+                messages = [EmailMessage(subject, body, to=[email], connection=connection) for email in batch]
+                batch_sent = connection.send_messages(messages) or 0
+                sent += batch_sent
+                if not claimed.update(sent_count=F('sent_count') + batch_sent, last_email=batch[-1]):
+                    return sent
+    except Exception as error:
+        result = {'status': CourseNotification.STATUS_FAILED, 'error': str(error)}
+        if notification.attempts < settings.COURSE_NOTIFICATION_MAX_ATTEMPTS:
+            retry_delay = settings.COURSE_NOTIFICATION_RETRY_DELAY * notification.attempts
+            result['scheduled_at'] = timezone.now() + timedelta(seconds=retry_delay)
+    claimed.update(processed_at=timezone.now(), **result)
+    return sent
+
+
+def process_due_notifications(limit=100):
+    """ Обработка наступивших заданий, возвращает количество обработанных заданий и отправленных писем """
+
+    notifications = claim_due_notifications(limit)
+    sent = sum(send_course_notification(notification) for notification in notifications)
+    return len(notifications), sent
@@ -1,4 +1,13 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 
 
 class EducationPaginator(PageNumberPagination):
@@ -7,3 +16,89 @@ class EducationPaginator(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'per_page'
     max_page_size = 100
+
+
+class ApproximateCountDjangoPaginator(Paginator):
+    """
+    Paginator с приблизительным подсчетом записей: для больших выборок в PostgreSQL число строк
+    берется из оценки планировщика, небольшие выборки и другие СУБД считаются точно.
+    Большие значения кэшируются на PAGINATION_COUNT_CACHE_TIMEOUT секунд
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        try:
+            sql, params = queryset.query.get_compiler(using=queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        cache_key = 'education:count:' + hashlib.md5(f'{queryset.db}:{sql}:{params}'.encode()).hexdigest()
+
+        count = cache.get(cache_key)
+        if count is not None:
+            return count
+
+        threshold = settings.PAGINATION_APPROXIMATE_COUNT_THRESHOLD
+        count = self.estimate_count(queryset.db, sql, params)
+        if count is None or count < threshold:
+            count = queryset.count()
+        if count >= threshold:
+            cache.set(cache_key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
+
+    @staticmethod
+    def estimate_count(using, sql, params):
+        """ Оценка числа строк по статистике планировщика PostgreSQL, для других СУБД - None """
+
+        connection = connections[using]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(EducationPaginator):
+    """ Постраничный пагинатор с приблизительным подсчетом записей для больших таблиц """
+
+    django_paginator_class = ApproximateCountDjangoPaginator
+
+
+class EducationCursorPaginator(CursorPagination):
+    """ Курсорный (keyset) пагинатор: скорость выдачи страницы не зависит от ее глубины """
+
+    page_size = 10
+    page_size_query_param = 'per_page'
+    max_page_size = 100
+    ordering = 'pk'
+
+
+class PaymentCursorPaginator(EducationCursorPaginator):
+    """ Курсорный пагинатор для платежей, начиная с самых новых """
+
+    ordering = ('-payment_date', '-pk')
+
+
+class PaginationModeMixin:
+    """
+    Миксин для выбора режима пагинации в запросе:
+    ?pagination=cursor включает курсорную пагинацию, иначе используется постраничная
+    """
+
+    cursor_pagination_class = EducationCursorPaginator
+    pagination_query_param = 'pagination'
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            query_params = self.request.query_params
+            if query_params.get(self.pagination_query_param) == 'cursor' or 'cursor' in query_params:
+                self._paginator = self.cursor_pagination_class()
+            elif self.pagination_class is None:
+                self._paginator = None
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
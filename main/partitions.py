@@ -0,0 +1,172 @@
+import datetime
+
+from django.db import transaction
+
+PAYMENT_TABLE = 'main_payment'
+
+
+def month_start(value):
+    """ Первое число месяца даты """
+
+    return datetime.date(value.year, value.month, 1)
+
+
+def add_months(value, months):
+    """ Первое число месяца, отстоящего от месяца даты на months """
+
+    month_index = value.year * 12 + value.month - 1 + months
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_partition_name(month):
+    """ Имя месячной секции таблицы платежей: main_payment_y2023m10 """
+
+    return f'{PAYMENT_TABLE}_y{month.year}m{month.month:02d}'
+
+
+def is_partitioned(connection, table=PAYMENT_TABLE):
+    """ Секционирована ли таблица (только PostgreSQL, в остальных СУБД таблица обычная) """
+
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def get_partitions(connection, table=PAYMENT_TABLE):
+    """ Месячные секции таблицы: {первое число месяца: имя секции}, секция DEFAULT не включается """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(%s)
+            """,
+            [table],
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = {}
+    for name in names:
+        suffix = name[len(table) + 1:]
+        if suffix.startswith('y') and 'm' in suffix:
+            year, month = suffix[1:].split('m')
+            partitions[datetime.date(int(year), int(month), 1)] = name
+    return partitions
+
+
+def get_month_bounds(month):
+    """ Границы месяца по UTC, как хранится payment_date: [начало месяца, начало следующего) """
+
+    start, end = month_start(month), add_months(month, 1)
+    return (datetime.datetime.combine(start, datetime.time.min, tzinfo=datetime.timezone.utc),
+            datetime.datetime.combine(end, datetime.time.min, tzinfo=datetime.timezone.utc))
+
+
+def create_partition(connection, month, table=PAYMENT_TABLE):
+    """
+    Создание секции платежей за месяц, если ее еще нет. Платежи этого месяца, уже попавшие в секцию DEFAULT
+    (история до первой секции или даты дальше созданных наперед), переносятся в новую секцию: иначе PostgreSQL
+    не даст создать секцию, пока в DEFAULT есть подходящие ей строки
+    """
+
+    quote_name = connection.ops.quote_name
+    name = get_partition_name(month_start(month))
+    default = f'{table}_default'
+    start, end = get_month_bounds(month)
+    in_month = '"payment_date" >= %s AND "payment_date" < %s'
+    bounds = f"FOR VALUES FROM ('{start.date().isoformat()} 00:00:00+00') TO ('{end.date().isoformat()} 00:00:00+00')"
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL, to_regclass(%s) IS NOT NULL', [name, default])
+        exists, has_default = cursor.fetchone()
+        if exists:
+            return
+        in_default = False
+        if has_default:
+            cursor.execute(f'SELECT EXISTS (SELECT 1 FROM {quote_name(default)} WHERE {in_month})', [start, end])
+            in_default = cursor.fetchone()[0]
+        if not in_default:
+            cursor.execute(f'CREATE TABLE {quote_name(name)} PARTITION OF {quote_name(table)} {bounds}')
+            return
+
+        # Отсоединяем DEFAULT, создаем секцию месяца, переносим в нее строки и возвращаем DEFAULT обратно
+        cursor.execute(f'ALTER TABLE {quote_name(table)} DETACH PARTITION {quote_name(default)}')
+        cursor.execute(f'CREATE TABLE {quote_name(name)} PARTITION OF {quote_name(table)} {bounds}')
+        cursor.execute(
+            f'INSERT INTO {quote_name(name)} SELECT * FROM {quote_name(default)} WHERE {in_month}', [start, end],
+        )
+        cursor.execute(f'DELETE FROM {quote_name(default)} WHERE {in_month}', [start, end])
+        cursor.execute(f'ALTER TABLE {quote_name(table)} ATTACH PARTITION {quote_name(default)} DEFAULT')
+
+
+def _get_index_definitions(cursor, table):
+    cursor.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND schemaname = current_schema() AND indexname NOT LIKE %s
+        """,
+        [table, '%_pkey'],
+    )
+    return cursor.fetchall()
+
+
+def _get_foreign_keys(cursor, table):
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype = 'f'",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def rebuild_table(schema_editor, partitioned, table=PAYMENT_TABLE):
+    """
+    Пересоздание таблицы платежей секционированной по месяцам payment_date (partitioned=True) или обычной.
+    Первичный ключ секционированной таблицы - (id, payment_date): PostgreSQL требует ключ секционирования
+    во всех уникальных индексах, уникальность id по-прежнему обеспечивает последовательность identity.
+    Создаются секции на все месяцы с платежами и на три месяца вперед, остальное попадает в секцию DEFAULT
+    """
+
+    connection = schema_editor.connection
+    quote_name = connection.ops.quote_name
+    old_table = f'{table}_old'
+    like = f'LIKE {quote_name(old_table)} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS'
+    with connection.cursor() as cursor:
+        # Определения индексов и внешних ключей ссылаются на имя таблицы, поэтому подходят и для новой таблицы
+        indexes = _get_index_definitions(cursor, table)
+        foreign_keys = _get_foreign_keys(cursor, table)
+        cursor.execute(f'ALTER TABLE {quote_name(table)} RENAME TO {quote_name(old_table)}')
+
+        if partitioned:
+            cursor.execute(f'CREATE TABLE {quote_name(table)} ({like}) PARTITION BY RANGE ("payment_date")')
+            cursor.execute(f'CREATE TABLE {quote_name(table + "_default")} PARTITION OF {quote_name(table)} DEFAULT')
+            cursor.execute(f'SELECT min("payment_date"), max("payment_date") FROM {quote_name(old_table)}')
+            first, last = cursor.fetchone()
+            today = datetime.date.today()
+            month = month_start(first.date() if first else today)
+            last_month = add_months(max(last.date() if last else today, today), 3)
+            while month <= last_month:
+                create_partition(connection, month, table)
+                month = add_months(month, 1)
+        else:
+            cursor.execute(f'CREATE TABLE {quote_name(table)} ({like})')
+
+        cursor.execute(f'INSERT INTO {quote_name(table)} SELECT * FROM {quote_name(old_table)}')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(\"id\"), 0) + 1, false) "
+            f'FROM {quote_name(table)}',
+            [table],
+        )
+        # Старая таблица удаляется вместе с индексами, после этого их имена можно использовать снова
+        cursor.execute(f'DROP TABLE {quote_name(old_table)}')
+
+        primary_key = '"id", "payment_date"' if partitioned else '"id"'
+        cursor.execute(
+            f'ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(table + "_pkey")} PRIMARY KEY ({primary_key})'
+        )
+        # Индексы на секционированной таблице создаются и во всех ее секциях
+        for _, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(name)} {definition}')
@@ -1,8 +1,22 @@
+from django.db.models import Q
 from rest_framework import permissions
 
+from main.models import Course
 from users.models import UserRoles
 
 
+def get_accessible_course_ids(request):
+    """ Id курсов, которыми пользователь владеет или в которых у него есть уроки. Загружаются один раз за запрос """
+
+    course_ids = getattr(request, '_accessible_course_ids', None)
+    if course_ids is None:
+        course_ids = set(
+            Course.objects.filter(Q(owner=request.user) | Q(lesson__owner=request.user)).values_list('pk', flat=True)
+        )
+        request._accessible_course_ids = course_ids
+    return course_ids
+
+
 class IsModeratorOrReadOnly(permissions.BasePermission):
     """ Разрешение - Модератор или только чтение """
 
@@ -12,22 +26,29 @@ class IsModeratorOrReadOnly(permissions.BasePermission):
         return request.user.role == UserRoles.MODERATOR
 
 
+class IsModerator(permissions.BasePermission):
+    """ Разрешение - Модератор """
+
+    def has_permission(self, request, view):
+        return request.user.role == UserRoles.MODERATOR
+
+
 class IsCourseOwner(permissions.BasePermission):
     """ Разрешение - Владелец курса """
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
+        return obj.owner_id == request.user.pk
 
 
 class IsCourseOrLessonOwner(permissions.BasePermission):
     """ Разрешение - Владелец курса или урока """
 
     def has_object_permission(self, request, view, obj):
-        return obj.course.owner == request.user or obj.course.lesson_set.filter(owner=request.user).exists()
+        return obj.course_id in get_accessible_course_ids(request)
 
 
 class IsPaymentOwner(permissions.BasePermission):
     """ Разрешение - Владелец платежа """
 
     def has_object_permission(self, request, view, obj):
-        return obj.owner == request.user
\ No newline at end of file
+        return obj.owner_id == request.user.pk
@@ -1,62 +1,265 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.relations import SlugRelatedField
 
-from main.models import Course, Lesson, Payment, Subscription
-from main.validators import LinkValidator
+from main.images import get_rendition_urls
+from main.models import Course, Lesson, Payment, Subscription, make_content_hash
+from main.notifications import schedule_course_notification
+from main.validators import ContentHashUniqueValidator, LinkValidator
 from users.models import User
 
 
-class LessonSerializer(serializers.ModelSerializer):
+def parse_list_param(value):
+    """ Разбор параметра запроса вида 'a,b,c' в множество имен """
+
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """ Поле с URL уменьшенных копий изображения: {'thumb': url, ...} или None, если изображения нет """
+
+    def to_representation(self, value):
+        urls = get_rendition_urls(value)
+        request = self.context.get('request')
+        if urls is None or request is None:
+            return urls
+        return {rendition: request.build_absolute_uri(url) for rendition, url in urls.items()}
+
+
+class DynamicFieldsMixin:
+    """
+    Миксин сериализатора для выборочного вывода полей по параметру ?fields=id,name.
+    Поля из Meta.expandable_fields выводятся только по запросу ?expand=<поле>
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        query_params = request.query_params if request is not None else {}
+
+        expand = parse_list_param(query_params.get('expand'))
+        for name in getattr(self.Meta, 'expandable_fields', ()):
+            if name not in expand:
+                self.fields.pop(name, None)
+
+        # На запись сериализатор всегда работает с полным набором полей
+        requested = parse_list_param(query_params.get('fields'))
+        if requested and request.method in SAFE_METHODS:
+            for name in list(self.fields):
+                if name not in requested and name not in expand:
+                    self.fields.pop(name)
+
+    @classmethod
+    def narrow_queryset(cls, queryset, fields):
+        """ Ограничиваем выборку колонками выводимых полей, связанные модели SlugRelatedField подгружаем JOIN-ом """
+
+        model = cls.Meta.model
+        concrete_fields = {field.name for field in model._meta.concrete_fields}
+        # Поля с auto_now загружаем всегда, иначе при сохранении объекта они не обновятся
+        columns = {model._meta.pk.name}
+        columns.update(field.name for field in model._meta.concrete_fields if getattr(field, 'auto_now', False))
+        for name in fields:
+            field = cls._declared_fields.get(name)
+            # Объявленное поле может выводить другую колонку модели через source
+            source = field.source if field is not None and field.source else name
+            if isinstance(field, SlugRelatedField):
+                queryset = queryset.select_related(source)
+                columns.add(f'{source}__{field.slug_field}')
+            elif source in concrete_fields:
+                columns.add(source)
+        return queryset.only(*columns)
+
+
+class LessonSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для модели уроков"""
 
     course = SlugRelatedField(slug_field='name', queryset=Course.objects.all())
+    preview_renditions = ImageRenditionsField(source='preview')
 
     class Meta:
         model = Lesson
-        fields = '__all__'
+        # Дата изменения передается в заголовках ETag и Last-Modified, хэш нужен только для проверки уникальности
+        exclude = ('updated_at', 'content_hash')
+        validators = [
+            LinkValidator(fields=['name', 'description', 'video_url']),
+            ContentHashUniqueValidator(queryset=Lesson.objects.all())
+        ]
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields, request=None):
+        """ Загружаем только выводимые колонки, название курса - в том же запросе, что и уроки """
+
+        return cls.narrow_queryset(queryset, fields)
+
+
+class LessonBulkListSerializer(serializers.ListSerializer):
+    """
+    Пакетная проверка и сохранение списка уроков: курсы ищутся одним запросом по названиям,
+    уникальность пар (name, description) проверяется одним запросом по хэшам на весь список
+    """
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        errors = [{} for _ in items]
+
+        course_names = {item['course'] for item in items}
+        # Названия курсов не уникальны, поэтому собираем все курсы с каждым названием
+        courses = defaultdict(list)
+        for course in Course.objects.filter(name__in=course_names):
+            courses[course.name].append(course)
+
+        lesson_ids = {item['id'] for item in items if 'id' in item}
+        self.existing_lessons = {}
+        if lesson_ids:
+            # Обновлять можно только уроки, доступные пользователю в представлении
+            self.existing_lessons = self.context['view'].get_queryset().in_bulk(lesson_ids)
+
+        hashes = [make_content_hash(item['name'], item['description']) for item in items]
+        # Уже существующие хэши пар (name, description) и id уроков, которым они принадлежат
+        taken = dict(Lesson.objects.filter(content_hash__in=hashes).values_list('content_hash', 'pk'))
+        seen = set()
+        for index, (item, content_hash) in enumerate(zip(items, hashes)):
+            matches = courses.get(item['course'], [])
+            if not matches:
+                errors[index]['course'] = ['Курс с таким названием не найден.']
+            elif len(matches) > 1:
+                errors[index]['course'] = ['Найдено несколько курсов с таким названием.']
+            else:
+                item['course'] = matches[0]
+
+            if 'id' in item and item['id'] not in self.existing_lessons:
+                errors[index]['id'] = ['Урок не найден.']
+
+            if content_hash in seen or taken.get(content_hash, item.get('id')) != item.get('id'):
+                errors[index]['non_field_errors'] = [ContentHashUniqueValidator.message]
+            seen.add(content_hash)
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def create(self, validated_data):
+        owner = self.context['request'].user
+        now = timezone.now()
+        # Курсы, из которых переносятся обновляемые уроки, тоже изменились
+        previous_course_ids = {lesson.course_id for lesson in self.existing_lessons.values()}
+        lessons = []
+        new_lessons = []
+        updated_lessons = []
+        for item in validated_data:
+            if 'id' in item:
+                lesson = self.existing_lessons[item['id']]
+                for attr, value in item.items():
+                    setattr(lesson, attr, value)
+                # bulk_update не вызывает save(), поэтому дату изменения и хэш выставляем сами
+                lesson.updated_at = now
+                lesson.content_hash = make_content_hash(lesson.name, lesson.description)
+                updated_lessons.append(lesson)
+            else:
+                lesson = Lesson(owner=owner, **item)
+                new_lessons.append(lesson)
+            lessons.append(lesson)
+
+        with transaction.atomic():
+            Lesson.objects.bulk_create(new_lessons)
+            if updated_lessons:
+                Lesson.objects.bulk_update(
+                    updated_lessons, ['course', 'name', 'description', 'video_url', 'updated_at', 'content_hash'],
+                )
+            # Массовые операции идут без сигналов, поэтому рассылку подписчикам ставим в очередь сами
+            course_ids = previous_course_ids | {lesson.course_id for lesson in lessons}
+            for course_id in course_ids:
+                transaction.on_commit(lambda course_id=course_id: schedule_course_notification(course_id))
+        return lessons
+
+
+class LessonBulkItemSerializer(serializers.ModelSerializer):
+    """Сериализатор элемента пакетной загрузки уроков: урок с id обновляется, без id - создается"""
+
+    id = serializers.IntegerField(required=False)
+    # Курс проверяется пакетно в LessonBulkListSerializer по названию
+    course = serializers.CharField(max_length=250)
+
+    class Meta:
+        model = Lesson
+        fields = ['id', 'course', 'name', 'description', 'video_url']
+        list_serializer_class = LessonBulkListSerializer
         validators = [
             LinkValidator(fields=['name', 'description', 'video_url']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Lesson.objects.all())
         ]
 
 
 class LessonListSerializer(serializers.ModelSerializer):
     """Сериализотор для модели урока для использования его в выводе в курсах"""
 
+    preview_renditions = ImageRenditionsField(source='preview')
+
     class Meta:
         model = Lesson
-        fields = ['id', 'name', 'description', 'preview', 'video_url']
+        fields = ['id', 'name', 'description', 'preview', 'preview_renditions', 'video_url']
 
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """Сериализатор для модели курсов"""
 
-    # Выводим счетчик уроков
-    lessons_count = serializers.IntegerField(source='lesson_set.count', read_only=True)
-    # Расширяем сериализатор дополнительным вложенным полем с уроками
+    # Выводим сохраненный в курсе счетчик уроков
+    lessons_count = serializers.IntegerField(read_only=True)
+    # Расширяем сериализатор дополнительным вложенным полем с уроками, выводится по запросу ?expand=lessons
     lessons = serializers.SerializerMethodField()
+    # Уменьшенные копии превью для списков курсов
+    preview_renditions = ImageRenditionsField(source='preview')
+
+    # Подписан ли текущий пользователь на курс, для списков вычисляется подзапросом в основном запросе
+    is_subscribed = serializers.SerializerMethodField()
 
     # Выводим имя пользователя в поле "owner", вместо цифры
     owner = SlugRelatedField(slug_field='first_name', queryset=User.objects.all())
 
     class Meta:
         model = Course
-        fields = '__all__'
+        # Дата изменения передается в заголовках ETag и Last-Modified, хэш нужен только для проверки уникальности
+        exclude = ('updated_at', 'content_hash')
+        expandable_fields = ('lessons',)
         validators = [
             LinkValidator(fields=['name', 'description']),
-            serializers.UniqueTogetherValidator(fields=['name', 'description'], queryset=Course.objects.all())
+            ContentHashUniqueValidator(queryset=Course.objects.all())
         ]
 
-    # Получаем все поля для дополнительного поля уроков с фильтрацией по курсу
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields, request=None):
+        """
+        Загружаем выводимые колонки курсов, а уроки - одним запросом на всю страницу при ?expand=lessons.
+        Статус подписки пользователя добавляется к запросу курсов через EXISTS
+        """
+
+        queryset = cls.narrow_queryset(queryset, fields)
+        if 'is_subscribed' in fields and request is not None:
+            subscriptions = Subscription.objects.filter(user=request.user, course=OuterRef('pk'), is_subscribed=True)
+            queryset = queryset.annotate(is_subscribed=Exists(subscriptions))
+        if 'lessons' in fields:
+            lessons = Lesson.objects.only('course', 'name', 'description', 'preview', 'video_url')
+            queryset = queryset.prefetch_related(Prefetch('lesson_set', queryset=lessons))
+        return queryset
+
+    # Получаем все поля для дополнительного поля уроков из предзагруженного списка уроков курса
     def get_lessons(self, course):
-        return LessonListSerializer(Lesson.objects.filter(course=course), many=True).data
+        return LessonListSerializer(course.lesson_set.all(), many=True, context=self.context).data
 
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        return Subscription.objects.filter(user=user, course=obj).exists()
+    def get_is_subscribed(self, course):
+        # Курсы из setup_eager_loading уже содержат статус, запрос нужен только для созданного или измененного курса
+        is_subscribed = getattr(course, 'is_subscribed', None)
+        if is_subscribed is None:
+            user = self.context['request'].user
+            is_subscribed = Subscription.objects.filter(user=user, course=course, is_subscribed=True).exists()
+        return is_subscribed
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """ Сериализотор для модели платежей """
 
     course = SlugRelatedField(slug_field='name', queryset=Course.objects.all())
@@ -67,6 +270,12 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = '__all__'
 
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields, request=None):
+        """ Загружаем только выводимые колонки, названия курса, урока и почту владельца - в том же запросе """
+
+        return cls.narrow_queryset(queryset, fields)
+
 
 class PaymentForOwnerSerializer(serializers.ModelSerializer):
     """ Сериализотор для модели платежей для использования его в выводе у пользователей """
@@ -79,6 +288,15 @@ class PaymentForOwnerSerializer(serializers.ModelSerializer):
 class SubscriptionSerializer(serializers.ModelSerializer):
     """ Сериализотор для модели подписки пользователя на курс """
 
+    # Подписка всегда создается от имени текущего пользователя, поле нужно и для проверки уникальности пары
+    user = serializers.PrimaryKeyRelatedField(read_only=True, default=serializers.CurrentUserDefault())
+
     class Meta:
         model = Subscription
         fields = '__all__'
+
+
+class SubscriptionToggleSerializer(serializers.Serializer):
+    """ Сериализатор запроса на переключение подписки текущего пользователя на курс """
+
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all())
@@ -0,0 +1,197 @@
+import threading
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from main.cache import get_user_scope, invalidate_scopes, invalidate_users
+from main.images import register_image_renditions
+from main.models import Course, Lesson, Payment, PaymentDailyRollup, Subscription
+from main.notifications import schedule_course_notification
+
+register_image_renditions(Course, 'preview')
+register_image_renditions(Lesson, 'preview')
+
+# Курсы, удаляемые в текущем потоке, и операция удаления (origin сигналов), в которой они удаляются:
+# при каскадном удалении их уроков счетчик не обновляется
+_deleting_courses = threading.local()
+
+
+def _get_deleting_course_ids(origin):
+    """
+    Курсы, удаляемые операцией origin. Отметки относятся только к своей операции, поэтому после удаления,
+    прерванного ошибкой, они не действуют на последующие изменения уроков этих курсов
+    """
+
+    if origin is None or getattr(_deleting_courses, 'origin', None) is not origin:
+        return set()
+    return _deleting_courses.ids
+
+
+def _touch_course(course_id, lessons_delta=0):
+    """ Изменение счетчика уроков курса на lessons_delta и даты изменения курса без чтения строки курса """
+
+    Course.objects.filter(pk=course_id).update(lessons_count=F('lessons_count') + lessons_delta, updated_at=Now())
+
+
+def _invalidate_lesson_cache(lesson, course_ids):
+    """ Сброс кэша владельца урока и владельцев курсов, в выводе которых урок присутствует """
+
+    course_ids = {course_id for course_id in course_ids if course_id is not None}
+    course_owner_ids = Course.objects.filter(pk__in=course_ids).values_list('owner_id', flat=True)
+    invalidate_users(lesson.owner_id, *course_owner_ids)
+
+
+def _notify_subscribers(*course_ids):
+    """ Рассылка подписчикам ставится в очередь после фиксации транзакции """
+
+    for course_id in set(course_ids) - {None}:
+        transaction.on_commit(lambda course_id=course_id: schedule_course_notification(course_id))
+
+
+@receiver(post_init, sender=Lesson)
+def remember_lesson_course(sender, instance, **kwargs):
+    """ Запоминаем курс урока при загрузке, чтобы отследить перенос урока в другой курс """
+
+    instance._loaded_course_id = instance.__dict__.get('course_id')
+
+
+@receiver(post_save, sender=Lesson)
+def on_lesson_saved(sender, instance, created, raw=False, **kwargs):
+    """ Обновление счетчика уроков, даты изменения курса и сброс кэша при сохранении урока """
+
+    if raw:
+        return
+    previous_course_id = instance._loaded_course_id
+    if created:
+        _touch_course(instance.course_id, 1)
+    elif previous_course_id != instance.course_id:
+        if previous_course_id is not None:
+            _touch_course(previous_course_id, -1)
+        _touch_course(instance.course_id, 1)
+    else:
+        # Урок выводится внутри курса, поэтому его изменение меняет и дату изменения курса
+        _touch_course(instance.course_id)
+    _invalidate_lesson_cache(instance, {previous_course_id, instance.course_id})
+    _notify_subscribers(previous_course_id, instance.course_id)
+    instance._loaded_course_id = instance.course_id
+
+
+@receiver(post_delete, sender=Lesson)
+def on_lesson_deleted(sender, instance, origin=None, **kwargs):
+    """ Обновление счетчика уроков и сброс кэша при удалении урока, кроме уроков, удаляемых вместе с курсом """
+
+    course_ids = {instance.course_id} - _get_deleting_course_ids(origin)
+    if course_ids:
+        _touch_course(instance.course_id, -1)
+    _invalidate_lesson_cache(instance, course_ids)
+    _notify_subscribers(*course_ids)
+
+
+@receiver(pre_delete, sender=Course)
+def mark_course_deleting(sender, instance, origin=None, **kwargs):
+    """ Отмечаем курс как удаляемый до каскадного удаления его уроков """
+
+    if origin is None:
+        return
+    if getattr(_deleting_courses, 'origin', None) is not origin:
+        # Новая операция удаления: отметки предыдущей, если она прервалась ошибкой, больше не нужны
+        _deleting_courses.origin = origin
+        _deleting_courses.ids = set()
+    _deleting_courses.ids.add(instance.pk)
+
+
+@receiver(post_delete, sender=Course)
+def on_course_deleted(sender, instance, origin=None, **kwargs):
+    """ Снимаем отметку после удаления курса и сбрасываем кэш его владельца """
+
+    deleting_course_ids = _get_deleting_course_ids(origin)
+    deleting_course_ids.discard(instance.pk)
+    if not deleting_course_ids and getattr(_deleting_courses, 'origin', None) is origin:
+        # Операция удаления завершена, ссылку на нее не храним
+        _deleting_courses.origin = None
+    invalidate_users(instance.owner_id)
+
+
+@receiver(post_init, sender=Course)
+def remember_course_owner(sender, instance, **kwargs):
+    """ Запоминаем владельца курса при загрузке, чтобы при смене владельца сбросить кэш обоих """
+
+    instance._loaded_owner_id = instance.__dict__.get('owner_id')
+
+
+@receiver(post_save, sender=Course)
+def on_course_saved(sender, instance, created, raw=False, **kwargs):
+    """ Сброс кэша владельца курса и владельцев его уроков и уведомление подписчиков при его изменении """
+
+    if not raw:
+        # Уроки выводят название курса, поэтому их владельцам, не владеющим курсом, тоже нужен сброс кэша
+        lesson_owner_ids = [] if created else Lesson.objects.filter(course=instance).values_list(
+            'owner_id', flat=True,
+        ).distinct()
+        invalidate_users(instance._loaded_owner_id, instance.owner_id, *lesson_owner_ids)
+        instance._loaded_owner_id = instance.owner_id
+        if not created:
+            _notify_subscribers(instance.pk)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def on_subscription_changed(sender, instance, **kwargs):
+    """ Подписка влияет только на ответы подписчика """
+
+    invalidate_scopes(get_user_scope(instance.user_id))
+
+
+def _get_rollup_group(payment):
+    """ Группа дневного итога платежа и его сумма или None, если поля платежа загружены не полностью """
+
+    fields = payment.__dict__
+    if any(name not in fields for name in ('payment_date', 'course_id', 'lesson_id', 'payment_method', 'amount')):
+        return None
+    # Дата могла быть присвоена строкой, приводим ее так же, как это делает поле модели при сохранении
+    payment_date = Payment._meta.get_field('payment_date').to_python(payment.payment_date)
+    if payment_date is None:
+        return None
+    if timezone.is_naive(payment_date):
+        payment_date = timezone.make_aware(payment_date)
+    group = (timezone.localdate(payment_date), payment.course_id, payment.lesson_id, payment.payment_method)
+    return group, payment.amount
+
+
+@receiver(post_init, sender=Payment)
+def remember_payment_rollup_group(sender, instance, **kwargs):
+    """ Запоминаем группу и сумму платежа при загрузке, чтобы перенести их в итогах при изменении платежа """
+
+    instance._loaded_rollup_group = _get_rollup_group(instance)
+
+
+@receiver(post_save, sender=Payment)
+def on_payment_saved(sender, instance, created, raw=False, **kwargs):
+    """ Обновление дневных итогов при создании и изменении платежа """
+
+    # Без исходных значений платежа изменение перенести нельзя, итоги пересчитываются командой rebuild_payment_rollups
+    if raw or (not created and instance._loaded_rollup_group is None):
+        return
+    previous = None if created else instance._loaded_rollup_group
+    current = _get_rollup_group(instance)
+    if previous != current:
+        if previous is not None:
+            group, amount = previous
+            PaymentDailyRollup.objects.add_payment(*group, amount=-amount, count=-1)
+        if current is not None:
+            group, amount = current
+            PaymentDailyRollup.objects.add_payment(*group, amount=amount)
+    instance._loaded_rollup_group = current
+
+
+@receiver(post_delete, sender=Payment)
+def on_payment_deleted(sender, instance, **kwargs):
+    """ Вычитаем удаленный платеж из дневных итогов """
+
+    if instance._loaded_rollup_group is not None:
+        group, amount = instance._loaded_rollup_group
+        PaymentDailyRollup.objects.add_payment(*group, amount=-amount, count=-1)
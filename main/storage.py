@@ -0,0 +1,54 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.views.static import serve
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище с именами файлов по хэшу содержимого: <каталог>/<ab>/<sha256>.<расширение>.
+    Одинаковые загрузки сохраняются в один файл, поэтому файлы хранилища не изменяются и не удаляются вместе с объектом
+    """
+
+    chunk_size = 64 * 1024
+
+    def get_content_hash(self, content):
+        """ Хэш содержимого по частям, без чтения всего файла в память """
+
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(self.chunk_size):
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    def get_hashed_name(self, name, content):
+        dirname, filename = os.path.split(name)
+        content_hash = self.get_content_hash(content)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(dirname, content_hash[:2], f'{content_hash}{extension}')
+
+    def _save(self, name, content):
+        hashed_name = self.get_hashed_name(name, content)
+        if self.exists(hashed_name):
+            return hashed_name
+        saved_name = super()._save(hashed_name, content)
+        # Тот же файл успели записать параллельно: копия под другим именем не нужна
+        if saved_name != hashed_name:
+            self.delete(saved_name)
+        return hashed_name
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def serve_immutable_media(request, path):
+    """ Отдача медиафайлов: имя файла меняется вместе с содержимым, поэтому ответ кэшируется навсегда """
+
+    response = serve(request, path, document_root=content_addressed_storage.location)
+    if response.status_code == 200:
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
@@ -1,10 +1,48 @@
+import csv
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import skipIf, skipUnless
+
+from django.core.cache import cache
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.signals import post_delete
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
 from rest_framework.reverse import reverse
 from rest_framework import status
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIRequestFactory, APITransactionTestCase
+from PIL import Image
 from rest_framework_simplejwt.tokens import AccessToken
 
-from main.models import Lesson, Course, Subscription
-from users.models import User
+from main.cache import get_cache_stats
+from main.images import get_rendition_name
+from main.notifications import claim_due_notifications
+from main.partitions import create_partition, get_partition_name, get_partitions
+from main.storage import serve_immutable_media
+from main.models import Lesson, Course, CourseNotification, IdempotencyKey, Payment, PaymentDailyRollup, \
+    Subscription, make_content_hash
+from main.permissions import IsCourseOrLessonOwner
+from main.validators import ContentHashUniqueValidator, LinkValidator
+from main.views import PaymentListAPIView
+from users.models import User, UserRoles
 
 
 class LessonTestCase(APITestCase):
@@ -59,6 +97,7 @@ class LessonTestCase(APITestCase):
                 "name": "TEST1",
                 "description": "TEST1",
                 "preview": None,
+                "preview_renditions": None,
                 "video_url": self.lesson.video_url,
                 "owner": self.user.pk
             }
@@ -91,6 +130,7 @@ class LessonTestCase(APITestCase):
                         "name": self.lesson.name,
                         "description": self.lesson.description,
                         "preview": None,
+                        "preview_renditions": None,
                         "video_url": self.lesson.video_url,
                         "owner": self.user.pk
                     }
@@ -119,6 +159,7 @@ class LessonTestCase(APITestCase):
                 "name": self.lesson.name,
                 "description": self.lesson.description,
                 "preview": None,
+                "preview_renditions": None,
                 "video_url": self.lesson.video_url,
                 "owner": self.user.pk
             }
@@ -152,6 +193,7 @@ class LessonTestCase(APITestCase):
                 "name": "TEST2",
                 "description": self.lesson.description,
                 "preview": None,
+                "preview_renditions": None,
                 "video_url": "https://youtube.com/test2/",
                 "owner": self.user.pk
             }
@@ -179,6 +221,7 @@ class LessonTestCase(APITestCase):
                 "name": "TEST3",
                 "description": "TEST3",
                 "preview": None,
+                "preview_renditions": None,
                 "video_url": "https://youtube.com/test3/",
                 "owner": self.user.pk
             }
@@ -228,9 +271,11 @@ class SubscriptionTestCase(APITestCase):
     def test_create_subscription(self):
         """ Тестирование подписки на курс """
 
+        # Подписка на курс из setUp уже есть, повторная подписка на него запрещена уникальностью пары
+        other_course = Course.objects.create(name="TEST2", description="TEST2", owner=self.user)
         data = {
             'user': self.user.pk,
-            'course': self.course.pk,
+            'course': other_course.pk,
             'is_subscribed': True
         }
 
@@ -256,10 +301,48 @@ class SubscriptionTestCase(APITestCase):
                 "id": 2,
                 "is_subscribed": True,
                 "user": self.user.pk,
-                "course": self.course.pk
+                "course": other_course.pk
             }
         )
 
+        response = self.client.post(
+            reverse('education:subscription-list'),
+            data=data,
+            HTTP_AUTHORIZATION=self.token
+        )
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    def test_toggle_subscription(self):
+        """ Тестирование переключения подписки одним запросом """
+
+        url = reverse('education:subscription-toggle')
+        other_course = Course.objects.create(name="TEST2", description="TEST2", owner=self.user)
+
+        responses = [
+            self.client.post(url, data={'course': course.pk}, HTTP_AUTHORIZATION=self.token).json()
+            for course in (self.course, self.course, other_course)
+        ]
+
+        self.assertEqual(
+            [(response['course'], response['is_subscribed']) for response in responses],
+            [(self.course.pk, True), (self.course.pk, False), (other_course.pk, True)]
+        )
+        self.assertEqual(responses[0]['id'], self.subscription.pk)
+        self.assertEqual(
+            Subscription.objects.filter(user=self.user).count(),
+            2
+        )
+
+        response = self.client.post(url, data={'course': 0}, HTTP_AUTHORIZATION=self.token)
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
     def test_unsubscribe(self):
         """ Тестирование отписки на курс """
 
@@ -313,6 +396,43 @@ class SubscriptionTestCase(APITestCase):
             1
         )
 
+    def test_list_subscription_scoped_and_paginated(self):
+        """ Пользователь получает постранично только свои подписки """
+
+        member = User.objects.create(email='member', password='member', role=UserRoles.MEMBER)
+        courses = [Course.objects.create(name=f'Course{index}', description='TEST') for index in range(12)]
+        Subscription.objects.bulk_create(
+            Subscription(user=member, course=course, is_subscribed=index % 2 == 0)
+            for index, course in enumerate(courses)
+        )
+        self.client.force_authenticate(user=member)
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('courses:subscription-list'))
+
+        self.assertEqual(
+            (response.json()['count'], len(response.json()['results'])),
+            (12, 10)
+        )
+        self.assertEqual(
+            {subscription['user'] for subscription in response.json()['results']},
+            {member.pk}
+        )
+
+        response = self.client.get(reverse('courses:subscription-list'), {'is_subscribed': True})
+
+        self.assertEqual(
+            response.json()['count'],
+            6
+        )
+
+        response = self.client.get(reverse('courses:subscription-detail', kwargs={'id': self.subscription.pk}))
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+
     def test_subscription_retrieve(self):
         """ Тестирование вывода одной подписки """
 
@@ -357,4 +477,1456 @@ class SubscriptionTestCase(APITestCase):
     def tearDown(self):
         self.user.delete()
         self.course.delete()
-        self.subscription.delete()
\ No newline at end of file
+        self.subscription.delete()
+
+class CourseQueryCountTestCase(APITestCase):
+    """ Тестирование количества запросов при выводе курсов """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.client.force_authenticate(user=self.moderator)
+
+    def create_courses(self, count):
+        """ Создание курсов с двумя уроками в каждом """
+
+        start = Course.objects.count()
+        for index in range(start, start + count):
+            course = Course.objects.create(name=f'Course{index}', description='TestCourseDescription',
+                                           owner=self.moderator)
+            for lesson_index in range(2):
+                Lesson.objects.create(course=course, name=f'Lesson{index}-{lesson_index}',
+                                      description='TestLessonDescription', owner=self.moderator)
+
+    def test_course_list_query_count(self):
+        """ Количество запросов на странице курсов не зависит от числа курсов """
+
+        self.create_courses(3)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('courses:courses-list'), {'per_page': 50, 'expand': 'lessons'})
+
+        self.assertEqual(
+            response.json()['results'][0]['lessons_count'],
+            2
+        )
+
+        # Кэш ответов сбрасывается после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_courses(30)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('courses:courses-list'), {'per_page': 50, 'expand': 'lessons'})
+
+        self.assertEqual(
+            len(response.json()['results']),
+            33
+        )
+
+    def test_course_retrieve_query_count(self):
+        """ Вывод одного курса выполняется фиксированным числом запросов """
+
+        self.create_courses(1)
+        course = Course.objects.get()
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': course.pk}),
+                                       {'expand': 'lessons'})
+
+        self.assertEqual(
+            [lesson['name'] for lesson in response.json()['lessons']],
+            ['Lesson0-0', 'Lesson0-1']
+        )
+
+    def test_course_is_subscribed(self):
+        """ Статус подписки выводится для всей страницы курсов без дополнительных запросов """
+
+        self.create_courses(3)
+        subscribed, unsubscribed, other_course = Course.objects.order_by('pk')
+        Subscription.objects.create(user=self.moderator, course=subscribed, is_subscribed=True)
+        Subscription.objects.create(user=self.moderator, course=unsubscribed, is_subscribed=False)
+        other = User.objects.create(email='other', password='other', role=UserRoles.MEMBER)
+        Subscription.objects.create(user=other, course=unsubscribed, is_subscribed=True)
+
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('courses:courses-list'), {'fields': 'id,is_subscribed'})
+
+        self.assertEqual(
+            response.json()['results'],
+            [{'id': subscribed.pk, 'is_subscribed': True}, {'id': unsubscribed.pk, 'is_subscribed': False},
+             {'id': other_course.pk, 'is_subscribed': False}]
+        )
+
+        # Изменение подписки сбрасывает кэш ответов пользователя
+        self.client.post(reverse('courses:subscription-toggle'), {'course': unsubscribed.pk})
+        response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': unsubscribed.pk}))
+
+        self.assertTrue(
+            response.json()['is_subscribed']
+        )
+
+
+class CursorPaginationTestCase(APITestCase):
+    """ Тестирование курсорной пагинации """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+        start = timezone.now()
+        for index in range(15):
+            Payment.objects.create(payment_date=start - timedelta(days=index), course=self.course,
+                                   lesson=self.lesson, amount=100 + index, payment_method='CASH', owner=self.user)
+
+    def test_payment_cursor_pagination(self):
+        """ Курсорная пагинация платежей отдает все записи от новых к старым без подсчета общего числа """
+
+        response = self.client.get(reverse('courses:payments_list'), {'pagination': 'cursor'})
+        page = response.json()
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+
+        self.assertNotIn('count', page)
+
+        amounts = [payment['amount'] for payment in page['results']]
+        response = self.client.get(page['next'])
+        amounts += [payment['amount'] for payment in response.json()['results']]
+
+        self.assertEqual(
+            amounts,
+            [100 + index for index in range(15)]
+        )
+
+        self.assertIsNone(response.json()['next'])
+
+    def test_lesson_page_number_pagination_by_default(self):
+        """ Без параметра pagination используется постраничная пагинация """
+
+        response = self.client.get(reverse('courses:lesson_list'))
+
+        self.assertEqual(
+            response.json()['count'],
+            1
+        )
+
+
+class ApproximateCountPaginatorTestCase(APITestCase):
+    """ Тестирование пагинатора с приблизительным подсчетом записей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.client.force_authenticate(user=self.moderator)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription')
+        for index in range(3):
+            Lesson.objects.create(course=self.course, name=f'Lesson{index}', description='TestLessonDescription')
+
+    @override_settings(PAGINATION_APPROXIMATE_COUNT_THRESHOLD=3)
+    def test_large_count_is_cached(self):
+        """ Число записей выше порога кэшируется и не пересчитывается на каждой странице """
+
+        response = self.client.get(reverse('courses:lesson_list'))
+        self.assertEqual(response.json()['count'], 3)
+
+        Lesson.objects.create(course=self.course, name='Lesson3', description='TestLessonDescription')
+        response = self.client.get(reverse('courses:lesson_list'))
+
+        self.assertEqual(
+            response.json()['count'],
+            3
+        )
+
+    @override_settings(PAGINATION_APPROXIMATE_COUNT_THRESHOLD=100)
+    def test_small_count_is_exact(self):
+        """ Число записей ниже порога всегда считается точно """
+
+        response = self.client.get(reverse('courses:lesson_list'))
+        self.assertEqual(response.json()['count'], 3)
+
+        Lesson.objects.create(course=self.course, name='Lesson3', description='TestLessonDescription')
+        response = self.client.get(reverse('courses:lesson_list'))
+
+        self.assertEqual(
+            response.json()['count'],
+            4
+        )
+
+
+class RoleScopedQuerysetTestCase(APITestCase):
+    """ Тестирование ограничения выборки по роли и количества запросов в списках уроков и платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.other_user = User.objects.create(email='other', password='other')
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+
+    def create_lessons_with_payments(self, count, owner):
+        """ Создание уроков и платежей за них """
+
+        for index in range(count):
+            lesson = Lesson.objects.create(course=self.course, name=f'{owner.email}{index}',
+                                           description='TestLessonDescription', owner=owner)
+            Payment.objects.create(payment_date=timezone.now(), course=self.course, lesson=lesson,
+                                   amount=100, payment_method='CASH', owner=owner)
+
+    def test_member_sees_only_own_objects(self):
+        """ Пользователь видит только свои уроки и платежи """
+
+        self.create_lessons_with_payments(2, self.user)
+        self.create_lessons_with_payments(3, self.other_user)
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.get(reverse('courses:lesson_list'))
+        self.assertEqual(response.json()['count'], 2)
+
+        response = self.client.get(reverse('courses:payments_list'))
+
+        self.assertEqual(
+            {payment['owner'] for payment in response.json()['results']},
+            {self.user.email}
+        )
+
+    def test_list_query_count(self):
+        """ Количество запросов в списках уроков и платежей не зависит от числа строк """
+
+        self.client.force_authenticate(user=self.moderator)
+        self.create_lessons_with_payments(2, self.user)
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('courses:lesson_list'))
+        with self.assertNumQueries(2):
+            self.client.get(reverse('courses:payments_list'))
+
+        self.create_lessons_with_payments(8, self.other_user)
+
+        with self.assertNumQueries(3):
+            self.client.get(reverse('courses:lesson_list'))
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('courses:payments_list'))
+
+        self.assertEqual(
+            len(response.json()['results']),
+            10
+        )
+
+
+class PermissionCacheTestCase(APITestCase):
+    """ Тестирование кэша доступа к курсам в разрешениях """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.other_user = User.objects.create(email='other', password='other')
+        self.own_course = Course.objects.create(name='OwnCourse', description='TestCourseDescription', owner=self.user)
+        self.shared_course = Course.objects.create(name='SharedCourse', description='TestCourseDescription',
+                                                   owner=self.other_user)
+        self.foreign_course = Course.objects.create(name='ForeignCourse', description='TestCourseDescription',
+                                                    owner=self.other_user)
+        Lesson.objects.create(course=self.shared_course, name='OwnLesson', description='TestLessonDescription',
+                              owner=self.user)
+        self.lessons = [
+            Lesson.objects.create(course=course, name=f'Lesson{index}', description='TestLessonDescription',
+                                  owner=self.other_user)
+            for index, course in enumerate([self.own_course, self.shared_course, self.foreign_course])
+        ]
+
+    def test_object_permission_uses_one_query_per_request(self):
+        """ Проверки доступа к урокам выполняются одним запросом на весь запрос пользователя """
+
+        request = Request(APIRequestFactory().get('/'))
+        request.user = self.user
+        permission = IsCourseOrLessonOwner()
+
+        with self.assertNumQueries(1):
+            allowed = [permission.has_object_permission(request, None, lesson) for lesson in self.lessons]
+
+        self.assertEqual(
+            allowed,
+            [True, True, False]
+        )
+
+
+class LessonsCountTestCase(APITestCase):
+    """ Тестирование сохраненного счетчика уроков курса """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.other_course = Course.objects.create(name='OtherCourse', description='TestCourseDescription',
+                                                  owner=self.user)
+
+    def assertLessonsCount(self, course, count):
+        course.refresh_from_db()
+        self.assertEqual(course.lessons_count, count)
+
+    def test_counter_follows_lesson_writes(self):
+        """ Счетчик меняется при создании, переносе и удалении урока """
+
+        lesson = Lesson.objects.create(course=self.course, name='Lesson', description='TestLessonDescription')
+        self.assertLessonsCount(self.course, 1)
+
+        lesson = Lesson.objects.get(pk=lesson.pk)
+        lesson.course = self.other_course
+        lesson.save()
+        self.assertLessonsCount(self.course, 0)
+        self.assertLessonsCount(self.other_course, 1)
+
+        lesson.delete()
+        self.assertLessonsCount(self.other_course, 0)
+
+    def test_counter_follows_bulk_operations(self):
+        """ Счетчик пересчитывается после массового создания и переноса уроков """
+
+        Lesson.objects.bulk_create([
+            Lesson(course=self.course, name=f'Lesson{index}', description='TestLessonDescription')
+            for index in range(3)
+        ])
+        self.assertLessonsCount(self.course, 3)
+
+        Lesson.objects.filter(name__in=['Lesson0', 'Lesson1']).update(course=self.other_course)
+        self.assertLessonsCount(self.course, 1)
+        self.assertLessonsCount(self.other_course, 2)
+
+        Lesson.objects.filter(course=self.other_course).delete()
+        self.assertLessonsCount(self.other_course, 0)
+
+    def test_failed_course_delete_keeps_counter(self):
+        """ После удаления курса, прерванного ошибкой, удаление его уроков снова обновляет счетчик """
+
+        lesson = Lesson.objects.create(course=self.course, name='Lesson', description='TestLessonDescription')
+        Lesson.objects.create(course=self.course, name='OtherLesson', description='TestLessonDescription')
+
+        def fail_delete(sender, **kwargs):
+            raise RuntimeError('Ошибка удаления')
+
+        post_delete.connect(fail_delete, sender=Lesson)
+        try:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.course.delete()
+        finally:
+            post_delete.disconnect(fail_delete, sender=Lesson)
+
+        lesson.delete()
+        self.assertLessonsCount(self.course, 1)
+
+        self.course.delete()
+        self.assertFalse(Lesson.objects.filter(course_id=self.course.pk).exists())
+
+    def test_course_save_keeps_counter(self):
+        """ Сохранение ранее загруженного курса не перезаписывает счетчик """
+
+        course = Course.objects.get(pk=self.course.pk)
+        Lesson.objects.create(course=self.course, name='Lesson', description='TestLessonDescription')
+        course.name = 'RenamedCourse'
+        course.save()
+
+        self.assertLessonsCount(self.course, 1)
+
+    def test_recount_lessons_command(self):
+        """ Команда recount_lessons восстанавливает счетчики """
+
+        Lesson.objects.create(course=self.course, name='Lesson', description='TestLessonDescription')
+        Course.objects.update(lessons_count=10)
+
+        call_command('recount_lessons', batch_size=1, stdout=StringIO())
+
+        self.assertLessonsCount(self.course, 1)
+        self.assertLessonsCount(self.other_course, 0)
+
+
+class SparseFieldsetsTestCase(APITestCase):
+    """ Тестирование выборочного вывода полей и раскрытия вложенных уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member', first_name='Member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+
+    def test_course_lessons_are_opt_in(self):
+        """ Уроки курса выводятся только по запросу ?expand=lessons """
+
+        response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': self.course.pk}))
+        self.assertNotIn('lessons', response.json())
+
+        response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': self.course.pk}),
+                                   {'fields': 'id,name', 'expand': 'lessons'})
+
+        self.assertEqual(
+            response.json(),
+            {
+                "id": self.course.pk,
+                "name": self.course.name,
+                "lessons": [
+                    {
+                        "id": self.lesson.pk,
+                        "name": self.lesson.name,
+                        "description": self.lesson.description,
+                        "preview": None,
+                        "preview_renditions": None,
+                        "video_url": None
+                    }
+                ]
+            }
+        )
+
+    def test_fields_narrow_sql_columns(self):
+        """ Параметр fields сокращает вывод и список колонок в запросе """
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('courses:lesson_list'), {'fields': 'id,course'})
+
+        self.assertEqual(
+            response.json()['results'],
+            [{"id": self.lesson.pk, "course": self.course.name}]
+        )
+
+        select_sql = context.captured_queries[-1]['sql']
+        self.assertIn('"main_course"."name"', select_sql)
+        self.assertNotIn('"main_lesson"."description"', select_sql)
+
+
+class ResponseCacheTestCase(APITestCase):
+    """ Тестирование кэширования ответов курсов и уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.user = User.objects.create(email='member', password='member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+
+    def test_repeated_read_is_served_from_cache(self):
+        """ Повторный запрос отдается из кэша, к БД выполняется только запрос валидатора ETag """
+
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['name'], self.course.name)
+        self.assertEqual(get_cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_lesson_change_invalidates_course(self):
+        """ Изменение урока сбрасывает кэш курса, в который он входит """
+
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        self.client.get(url, {'expand': 'lessons'})
+
+        self.lesson.name = 'RenamedLesson'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.save()
+        response = self.client.get(url, {'expand': 'lessons'})
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['lessons'][0]['name'], 'RenamedLesson')
+
+    def test_invalidation_waits_for_commit(self):
+        """ Версия кэша меняется только после фиксации транзакции, до нее кэшируются еще прежние данные """
+
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.name = 'RenamedCourse'
+            self.course.save()
+            self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+        response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'RenamedCourse')
+
+    def test_course_rename_invalidates_lesson_owner(self):
+        """ Переименование курса сбрасывает кэш владельца урока курса, даже если курс ему не принадлежит """
+
+        lesson_owner = User.objects.create(email='other', password='other')
+        lesson = Lesson.objects.create(course=self.course, name='OtherLesson',
+                                       description='TestLessonDescription', owner=lesson_owner)
+        self.client.force_authenticate(user=lesson_owner)
+        url = reverse('courses:lesson_detail', kwargs={'pk': lesson.pk})
+        self.client.get(url)
+
+        self.course.name = 'RenamedCourse'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+        response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['course'], 'RenamedCourse')
+
+    def test_owner_rename_invalidates_courses(self):
+        """ Смена имени пользователя сбрасывает кэш его курсов, в которых оно выводится владельцем """
+
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        self.client.get(url)
+
+        self.user.first_name = 'RenamedMember'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['owner'], 'RenamedMember')
+
+    def test_cache_is_per_user(self):
+        """ Ответы одного пользователя не отдаются другому """
+
+        url = reverse('courses:lesson_detail', kwargs={'pk': self.lesson.pk})
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+
+        self.client.force_authenticate(user=User.objects.create(email='other', password='other'))
+
+        self.assertEqual(
+            self.client.get(url).status_code,
+            status.HTTP_404_NOT_FOUND
+        )
+
+
+class ConditionalGetTestCase(APITestCase):
+    """ Тестирование условных GET-запросов курсов и уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.user = User.objects.create(email='member', password='member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+
+    def test_course_list_not_modified(self):
+        """ Совпадающий ETag списка дает 304 одним запросом, изменение урока курса меняет ETag """
+
+        url = reverse('courses:courses-list')
+        etag = self.client.get(url)['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(course=self.course, name='NewLesson', description='TestLessonDescription')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertEqual(response.json()['results'][0]['lessons_count'], 2)
+
+    def test_lesson_detail_last_modified(self):
+        """ Деталь урока отдает Last-Modified и учитывает If-Modified-Since """
+
+        url = reverse('courses:lesson_detail', kwargs={'pk': self.lesson.pk})
+        last_modified = self.client.get(url)['Last-Modified']
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+
+    def test_lesson_detail_course_rename(self):
+        """ Переименование курса меняет ETag и Last-Modified его уроков, которые выводят название курса """
+
+        updated_at = timezone.now() - timedelta(hours=1)
+        Course.objects.update(updated_at=updated_at)
+        Lesson.objects.update(updated_at=updated_at)
+        url = reverse('courses:lesson_detail', kwargs={'pk': self.lesson.pk})
+        response = self.client.get(url)
+
+        self.course.name = 'RenamedCourse'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+
+        for headers in ({'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']},
+                        {'HTTP_IF_NONE_MATCH': response['ETag']}):
+            response_after_rename = self.client.get(url, **headers)
+
+            self.assertEqual(
+                response_after_rename.status_code,
+                status.HTTP_200_OK
+            )
+            self.assertEqual(response_after_rename.json()['course'], 'RenamedCourse')
+
+    def test_course_detail_subscription_change(self):
+        """ Деталь курса не отдает Last-Modified: подписка не меняет курс, но меняет ответ и ETag """
+
+        url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+        response = self.client.get(url)
+
+        self.assertNotIn('Last-Modified', response)
+        self.assertFalse(response.json()['is_subscribed'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Subscription.objects.create(user=self.user, course=self.course, is_subscribed=True)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time()),
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_200_OK
+        )
+        self.assertTrue(response.json()['is_subscribed'])
+
+
+class LessonBulkTestCase(APITestCase):
+    """ Тестирование пакетного создания и обновления уроков """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+
+    def post_batch(self, prefix, size):
+        """ Отправка пакета из size новых уроков и переименования существующего, возвращает ответ и число запросов """
+
+        data = [
+            {"course": self.course.name, "name": f"{prefix}{index}", "description": "TEST"}
+            for index in range(size)
+        ]
+        data.append({"id": self.lesson.pk, "course": self.course.name, "name": f"{prefix}Renamed",
+                     "description": self.lesson.description})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse('courses:lesson_bulk'), data=data, format='json')
+        # Точки сохранения транзакции не считаем
+        statements = [query for query in context.captured_queries if 'SAVEPOINT' not in query['sql']]
+        return response, len(statements)
+
+    def test_bulk_create_and_update(self):
+        """ Пакет из новых и существующих уроков сохраняется фиксированным числом запросов """
+
+        response, small_batch_queries = self.post_batch('Small', 2)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED
+        )
+
+        response, large_batch_queries = self.post_batch('Large', 20)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_201_CREATED
+        )
+        # Число запросов не зависит от размера пакета
+        self.assertEqual(large_batch_queries, small_batch_queries)
+
+        self.assertEqual(
+            Lesson.objects.filter(owner=self.user).count(),
+            23
+        )
+        self.lesson.refresh_from_db()
+        self.course.refresh_from_db()
+        self.assertEqual(self.lesson.name, 'LargeRenamed')
+        self.assertEqual(self.course.lessons_count, 23)
+
+    def test_bulk_reports_item_errors(self):
+        """ Ошибки возвращаются по каждому элементу, ничего не сохраняется """
+
+        data = [
+            {"course": self.course.name, "name": "Lesson", "description": "TEST"},
+            {"course": "UnknownCourse", "name": "Lesson1", "description": "TEST"},
+            {"course": self.course.name, "name": self.lesson.name, "description": self.lesson.description},
+            {"course": self.course.name, "name": "Lesson", "description": "TEST"},
+            {"course": "DuplicateCourse", "name": "Lesson2", "description": "TEST"},
+        ]
+        # Курсы с одинаковым названием: урок нельзя отнести ни к одному из них
+        Course.objects.create(name='DuplicateCourse', description='First', owner=self.user)
+        Course.objects.create(name='DuplicateCourse', description='Second', owner=self.user)
+
+        response = self.client.post(reverse('courses:lesson_bulk'), data=data, format='json')
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[1]), ['course'])
+        self.assertEqual(list(errors[2]), ['non_field_errors'])
+        self.assertEqual(list(errors[3]), ['non_field_errors'])
+        self.assertEqual(errors[4], {'course': ['Найдено несколько курсов с таким названием.']})
+        self.assertEqual(Lesson.objects.count(), 1)
+
+
+class ContentHashUniqueTestCase(APITestCase):
+    """ Тестирование уникальности названия и описания по хэшу """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.client.force_authenticate(user=self.user)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson',
+                                            description='TestLessonDescription', owner=self.user)
+
+    def test_duplicate_lesson_is_rejected(self):
+        """ Урок с уже существующими названием и описанием не создается """
+
+        data = {
+            "course": self.course.name,
+            "name": self.lesson.name,
+            "description": self.lesson.description,
+        }
+        response = self.client.post(reverse('courses:lesson_create'), data=data)
+
+        self.assertEqual(
+            response.status_code,
+            status.HTTP_400_BAD_REQUEST
+        )
+        self.assertEqual(
+            response.json(),
+            {"non_field_errors": [ContentHashUniqueValidator.message]}
+        )
+
+    def test_hash_follows_updates(self):
+        """ Хэш пересчитывается при сохранении и массовом обновлении, а БД не допускает дубликатов """
+
+        self.lesson.description = 'NewDescription'
+        self.lesson.save(update_fields=['description'])
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.content_hash, make_content_hash('TestLesson', 'NewDescription'))
+
+        Lesson.objects.filter(pk=self.lesson.pk).update(name='Renamed')
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.content_hash, make_content_hash('Renamed', 'NewDescription'))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Lesson.objects.create(course=self.course, name='Renamed', description='NewDescription')
+
+
+class LinkValidatorTestCase(APITestCase):
+    """ Тестирование проверки ссылок по списку разрешенных доменов """
+
+    def test_allowed_domains_and_subdomains(self):
+        """ Разрешены домены из списка и их поддомены, остальные ссылки отклоняются """
+
+        validator = LinkValidator(fields=['description'])
+
+        for text in ['https://youtube.com/watch', 'www.youtube.com', 'm.youtube.com/x', 'youtu.be/x',
+                     'версия 3.14 и v1.2', 'обычный текст']:
+            self.assertFalse(validator.has_external_links(text), text)
+
+        for text in ['https://evil.com', 'notyoutube.com', 'youtube.com.evil.ru', 'http://1.2.3.4/']:
+            self.assertTrue(validator.has_external_links(text), text)
+
+    @override_settings(LINK_VALIDATOR_ALLOWED_DOMAINS=['example.com'])
+    def test_allowed_domains_from_settings(self):
+        """ Список доменов берется из настроек, пустые поля не проверяются """
+
+        validator = LinkValidator(fields=['name', 'video_url'])
+        validator({'name': 'https://docs.example.com/page', 'video_url': None})
+
+        with self.assertRaises(ValidationError):
+            validator({'name': 'https://youtube.com', 'video_url': None})
+
+
+class ImageRenditionsTestCase(APITestCase):
+    """ Тестирование создания уменьшенных копий изображений """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = User.objects.create(email='member', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def create_preview(self):
+        """ PNG-изображение 1200x800 для превью """
+
+        image_file = BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(image_file, 'PNG')
+        return ContentFile(image_file.getvalue())
+
+    def test_renditions_created_after_upload(self):
+        """ После загрузки превью создаются копии в WebP, а их URL выводятся в API """
+
+        with self.settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS={'thumb': (160, 160)},
+                           IMAGE_RENDITIONS_ASYNC=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.course.preview.save('preview.png', self.create_preview())
+
+            thumb_name = get_rendition_name(self.course.preview.name, 'thumb')
+            with Image.open(os.path.join(self.media_root, thumb_name)) as thumb:
+                self.assertEqual(thumb.format, 'WEBP')
+                self.assertEqual(thumb.size, (160, 107))
+
+            response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': self.course.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['preview_renditions'], {'thumb': f'http://testserver/media/{thumb_name}'})
+
+    def test_rendition_urls_from_ready_mark(self):
+        """ URL копий выводятся по отметке о готовности без обращения к файлам хранилища """
+
+        with self.settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS={'thumb': (160, 160)},
+                           IMAGE_RENDITIONS_ASYNC=False):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.course.preview.save('preview.png', self.create_preview())
+            thumb_name = get_rendition_name(self.course.preview.name, 'thumb')
+            url = reverse('courses:courses-detail', kwargs={'pk': self.course.pk})
+
+            # Файл копии при выводе не проверяется
+            os.remove(os.path.join(self.media_root, thumb_name))
+            response = self.client.get(url)
+            self.assertEqual(response.json()['preview_renditions'],
+                             {'thumb': f'http://testserver/media/{thumb_name}'})
+
+            # Без отметки выводится оригинал
+            cache.clear()
+            response = self.client.get(url)
+
+        self.assertEqual(
+            response.json()['preview_renditions'],
+            {'thumb': f'http://testserver/media/{self.course.preview.name}'}
+        )
+
+    def test_failed_rendition_falls_back_to_original(self):
+        """ Ошибка создания копии записывается в лог, а вместо несуществующей копии выводится оригинал """
+
+        with self.settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS={'thumb': (160, 160)},
+                           IMAGE_RENDITIONS_ASYNC=False):
+            with self.assertLogs('main.images', 'ERROR') as logs:
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.course.preview.save('preview.png', ContentFile(b'not an image'))
+
+            response = self.client.get(reverse('courses:courses-detail', kwargs={'pk': self.course.pk}))
+
+        self.assertIn(self.course.preview.name, logs.output[0])
+        self.assertEqual(
+            response.json()['preview_renditions'],
+            {'thumb': f'http://testserver/media/{self.course.preview.name}'}
+        )
+
+
+class ContentAddressedStorageTestCase(APITestCase):
+    """ Тестирование хранения изображений по хэшу содержимого """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание тестового изображения """
+
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        image_file = BytesIO()
+        Image.new('RGB', (20, 20), 'blue').save(image_file, 'PNG')
+        self.image = image_file.getvalue()
+
+    def test_identical_uploads_deduplicated(self):
+        """ Одинаковые изображения сохраняются в один файл с именем по хэшу """
+
+        with self.settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS_ASYNC=False):
+            course = Course.objects.create(name='TestCourse1', description='TestCourseDescription')
+            lesson = Lesson.objects.create(name='TestLesson1', description='TestLessonDescription', course=course)
+            course.preview.save('first.PNG', ContentFile(self.image))
+            lesson.preview.save('second.png', ContentFile(self.image))
+            other = Course.objects.create(name='TestCourse2', description='TestCourseDescription')
+            other.preview.save('third.png', ContentFile(self.image))
+
+        content_hash = hashlib.sha256(self.image).hexdigest()
+        self.assertEqual(course.preview.name, f'main/course/{content_hash[:2]}/{content_hash}.png')
+        self.assertEqual(other.preview.name, course.preview.name)
+        self.assertEqual(lesson.preview.name, f'lessons/{content_hash[:2]}/{content_hash}.png')
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'main/course', content_hash[:2])),
+                         [f'{content_hash}.png'])
+
+    def test_media_served_immutable(self):
+        """ Медиафайлы отдаются с заголовком неизменяемого кэширования """
+
+        with self.settings(MEDIA_ROOT=self.media_root, IMAGE_RENDITIONS_ASYNC=False):
+            course = Course.objects.create(name='TestCourse1', description='TestCourseDescription')
+            course.preview.save('first.png', ContentFile(self.image))
+            response = serve_immutable_media(APIRequestFactory().get('/media/'), course.preview.name)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            self.assertEqual(b''.join(response.streaming_content), self.image)
+
+
+class PaymentRevenueTestCase(APITestCase):
+    """ Тестирование выручки по дневным итогам платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.other_course = Course.objects.create(name='OtherCourse', description='TestCourseDescription',
+                                                  owner=self.user)
+        self.day = timezone.now().replace(hour=12)
+        for amount, course, method, days in [(100, self.course, 'CASH', 0), (200, self.course, 'TRANSFER', 0),
+                                             (300, self.course, 'CASH', 1), (50, self.other_course, 'CASH', 1)]:
+            Payment.objects.create(payment_date=self.day - timedelta(days=days), course=course, amount=amount,
+                                   payment_method=method, owner=self.user)
+        self.client.force_authenticate(user=self.moderator)
+
+    def get_revenue(self, **params):
+        response = self.client.get(reverse('courses:payments_revenue'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_revenue_grouping(self):
+        """ Выручка группируется по курсам, способам оплаты и дням """
+
+        self.assertEqual(self.get_revenue(), [{'total_amount': 650, 'payments_count': 4}])
+        self.assertEqual(
+            self.get_revenue(group_by='course'),
+            [
+                {'course': self.course.pk, 'course_name': self.course.name, 'total_amount': 600, 'payments_count': 3},
+                {'course': self.other_course.pk, 'course_name': self.other_course.name, 'total_amount': 50,
+                 'payments_count': 1},
+            ]
+        )
+        self.assertEqual(
+            self.get_revenue(group_by='date,payment_method', course=self.course.pk),
+            [
+                {'date': str((self.day - timedelta(days=1)).date()), 'payment_method': 'CASH', 'total_amount': 300,
+                 'payments_count': 1},
+                {'date': str(self.day.date()), 'payment_method': 'CASH', 'total_amount': 100, 'payments_count': 1},
+                {'date': str(self.day.date()), 'payment_method': 'TRANSFER', 'total_amount': 200, 'payments_count': 1},
+            ]
+        )
+
+    def test_rollups_follow_payment_changes(self):
+        """ Изменение и удаление платежей переносятся в итоги так же, как при полном пересчете """
+
+        payment = Payment.objects.get(amount=300)
+        payment.amount = 350
+        payment.course = self.other_course
+        payment.save()
+        Payment.objects.get(amount=200).delete()
+
+        expected = [
+            {'course': self.course.pk, 'course_name': self.course.name, 'total_amount': 100, 'payments_count': 1},
+            {'course': self.other_course.pk, 'course_name': self.other_course.name, 'total_amount': 400,
+             'payments_count': 2},
+        ]
+        self.assertEqual(self.get_revenue(group_by='course'), expected)
+
+        call_command('rebuild_payment_rollups', stdout=StringIO())
+        self.assertEqual(PaymentDailyRollup.objects.count(), 2)
+        self.assertEqual(self.get_revenue(group_by='course'), expected)
+
+    def test_revenue_access_and_validation(self):
+        """ Выручка доступна только модераторам, группировка проверяется """
+
+        response = self.client.get(reverse('courses:payments_revenue'), {'group_by': 'owner'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('courses:payments_revenue'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class PaymentIndexUsageTestCase(APITestCase):
+    """ Тестирование использования составных индексов платежей фильтрами и сортировкой списка (по плану EXPLAIN) """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson', description='TestLessonDescription')
+
+    def get_list_queryset(self, user, **params):
+        """ Queryset списка платежей после фильтров представления, как при запросе GET payments/?<params> """
+
+        view = PaymentListAPIView(format_kwarg=None, kwargs={}, args=())
+        view.request = Request(APIRequestFactory().get('/', params))
+        view.request.user = user
+        return view.filter_queryset(view.get_queryset())
+
+    def assertUsesIndex(self, queryset, index_name):
+        """ План запроса использует индекс; в PostgreSQL чтение всей таблицы отключается, т.к. данных мало """
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        self.assertIn(index_name, plan)
+
+    def test_filters_use_composite_indexes(self):
+        """ Фильтры списка платежей с сортировкой по дате используют составные индексы """
+
+        cases = [
+            (self.user, {'ordering': '-payment_date'}, 'payment_owner_date_idx'),
+            (self.moderator, {'course': self.course.pk, 'ordering': '-payment_date'}, 'payment_course_date_idx'),
+            (self.moderator, {'lesson': self.lesson.pk, 'ordering': 'payment_date'}, 'payment_lesson_date_idx'),
+            (self.moderator, {'payment_method': 'CASH', 'ordering': '-payment_date'}, 'payment_method_date_idx'),
+            (self.moderator, {'ordering': '-payment_date'}, 'payment_date_idx'),
+            (self.moderator, {'pagination': 'cursor'}, 'payment_date_idx'),
+        ]
+        for user, params, index_name in cases:
+            with self.subTest(params=params):
+                queryset = self.get_list_queryset(user, **params)
+                if params.get('pagination') == 'cursor':
+                    queryset = queryset.order_by('-payment_date', '-pk')
+                self.assertUsesIndex(queryset, index_name)
+
+
+class PaymentExportTestCase(APITestCase):
+    """ Тестирование потоковой выгрузки платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.other_user = User.objects.create(email='other', password='other')
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson', description='TestLessonDescription')
+        self.payments = [
+            Payment.objects.create(payment_date=timezone.now(), course=self.course, lesson=self.lesson, amount=100,
+                                   payment_method='CASH', owner=self.user),
+            Payment.objects.create(payment_date=timezone.now(), course=self.course, amount=200,
+                                   payment_method='TRANSFER', owner=self.other_user),
+        ]
+
+    def export(self, file_format, **params):
+        response = self.client.get(reverse('courses:payments_export', kwargs={'file_format': file_format}), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        """ Выгрузка в CSV содержит названия курса, урока и почту владельца и учитывает фильтры """
+
+        self.client.force_authenticate(user=self.moderator)
+        rows = list(csv.reader(self.export('csv', payment_method='CASH').splitlines()))
+
+        self.assertEqual(rows[0], ['id', 'payment_date', 'amount', 'payment_method', 'course', 'lesson', 'owner'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][2:], ['100', 'CASH', self.course.name, self.lesson.name, self.user.email])
+
+    def test_export_ndjson(self):
+        """ Выгрузка в NDJSON: по объекту на строку, пользователь выгружает только свои платежи """
+
+        self.client.force_authenticate(user=self.other_user)
+        rows = [json.loads(line) for line in self.export('ndjson').splitlines()]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['id'], self.payments[1].pk)
+        self.assertEqual(rows[0]['lesson'], None)
+        self.assertEqual(rows[0]['owner'], self.other_user.email)
+
+        response = self.client.get(reverse('courses:payments_export', kwargs={'file_format': 'xml'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class IdempotencyKeyTestCase(APITestCase):
+    """ Тестирование повторов создания платежа с заголовком Idempotency-Key """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson', description='TestLessonDescription')
+        self.data = {'payment_date': '2023-10-20T10:00:00Z', 'course': self.course.name, 'lesson': self.lesson.name,
+                     'owner': self.user.email, 'amount': 100, 'payment_method': 'CASH'}
+        self.client.force_authenticate(user=self.user)
+
+    def create_payment(self, data, key):
+        return self.client.post(reverse('courses:payments_create'), data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        """ Повтор запроса с тем же ключом возвращает первый ответ без создания нового платежа """
+
+        first = self.create_payment(self.data, 'payment-1')
+        retry = self.create_payment(self.data, 'payment-1')
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Payment.objects.get().owner, self.user)
+
+        self.assertEqual(self.create_payment(self.data, 'payment-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Payment.objects.count(), 2)
+
+        response = self.create_payment({**self.data, 'amount': 200}, 'payment-1')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_errors_and_expired_keys_are_not_replayed(self):
+        """ Ответ с ошибкой не занимает ключ, ключ с истекшим сроком хранения используется заново """
+
+        response = self.create_payment({**self.data, 'amount': 'wrong'}, 'payment-1')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.create_payment(self.data, 'payment-1').status_code, status.HTTP_201_CREATED)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        response = self.create_payment(self.data, 'payment-1')
+
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(Payment.objects.count(), 2)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+
+        self.assertIn('Удалено ключей: 1', out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+    def test_expired_key_replaced_by_concurrent_retry(self):
+        """ Если истекший ключ успел занять параллельный повтор запроса, возвращается его ответ """
+
+        self.create_payment(self.data, 'payment-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+
+        def replace_key(sender, instance, **kwargs):
+            # Параллельный повтор удалил истекший ключ раньше и записал свой ответ
+            IdempotencyKey.objects.create(user=self.user, key=instance.key, fingerprint=instance.fingerprint,
+                                          status_code=status.HTTP_201_CREATED, response={'id': 0})
+
+        post_delete.connect(replace_key, sender=IdempotencyKey)
+        self.addCleanup(post_delete.disconnect, replace_key, sender=IdempotencyKey)
+        response = self.create_payment(self.data, 'payment-1')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'id': 0})
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Payment.objects.count(), 1)
+
+@skipUnless(connection.vendor == 'postgresql', 'Ожидание на уникальном индексе проверяется только в PostgreSQL')
+class IdempotencyKeyConcurrencyTestCase(APITransactionTestCase):
+    """ Тестирование параллельных запросов с одним Idempotency-Key """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_concurrent_request_waits_for_first(self):
+        """ Запрос с тем же ключом ждет фиксации первого и возвращает его ответ, не создавая платеж """
+
+        data = {'payment_date': '2023-10-20T10:00:00Z', 'course': self.course.name, 'owner': self.user.email,
+                'amount': 100, 'payment_method': 'CASH'}
+        fingerprint = hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest()
+        started = threading.Event()
+
+        def first_request():
+            # Первый запрос еще выполняется: ключ записан, но транзакция не зафиксирована
+            with transaction.atomic():
+                IdempotencyKey.objects.create(user=self.user, key='payment-1', fingerprint=fingerprint,
+                                              status_code=status.HTTP_201_CREATED, response={'id': 1})
+                started.set()
+                time.sleep(0.5)
+            connection.close()
+
+        thread = threading.Thread(target=first_request)
+        thread.start()
+        started.wait()
+        response = self.client.post(reverse('courses:payments_create'), data, format='json',
+                                    HTTP_IDEMPOTENCY_KEY='payment-1')
+        thread.join()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json(), {'id': 1})
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentArchiveTestCase(APITestCase):
+    """ Тестирование архивации старых платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        self.user = User.objects.create(email='member', password='member')
+        self.moderator = User.objects.create(email='moderator', password='moderator', role=UserRoles.MODERATOR)
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        for payment_date, amount in [('2021-11-30T10:00:00Z', 100), ('2021-12-15T10:00:00Z', 200),
+                                     ('2021-12-31T23:00:00Z', 300), ('2022-01-01T00:00:00Z', 400)]:
+            Payment.objects.create(payment_date=payment_date, course=self.course, amount=amount,
+                                   payment_method='CASH', owner=self.user)
+
+    def get_revenue(self):
+        self.client.force_authenticate(user=self.moderator)
+        return self.client.get(reverse('courses:payments_revenue'), {'group_by': 'month'}).json()
+
+    def test_archive_keeps_rollups(self):
+        """ Платежи до даты архивации переносятся в файлы по месяцам, выручка за прошлые периоды сохраняется """
+
+        revenue = self.get_revenue()
+        out = StringIO()
+        call_command('archive_payments', '--before=2022-01-01', output_dir=self.archive_dir, batch_size=2, stdout=out)
+
+        self.assertIn('Архивировано платежей: 3, файлов: 2', out.getvalue())
+        self.assertEqual(list(Payment.objects.values_list('amount', flat=True)), [400])
+        self.assertEqual(sorted(os.listdir(self.archive_dir)),
+                         ['payments-2021-11.ndjson.gz', 'payments-2021-12.ndjson.gz'])
+        with gzip.open(os.path.join(self.archive_dir, 'payments-2021-12.ndjson.gz'), 'rt', encoding='utf-8') as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([record['amount'] for record in records], [200, 300])
+        self.assertEqual(records[0]['course'], self.course.name)
+        self.assertEqual(records[0]['owner_id'], self.user.pk)
+
+        self.assertEqual(self.get_revenue(), revenue)
+        call_command('rebuild_payment_rollups', stdout=StringIO())
+        self.assertEqual(self.get_revenue(), revenue)
+
+    @skipIf(connection.vendor == 'postgresql', 'В PostgreSQL таблица платежей секционирована')
+    def test_ensure_partitions_without_postgresql(self):
+        """ Без PostgreSQL таблица платежей обычная и секции не создаются """
+
+        out = StringIO()
+        call_command('ensure_payment_partitions', stdout=out)
+
+        self.assertIn('не секционирована', out.getvalue())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Секционирование есть только в PostgreSQL')
+    def test_partition_takes_rows_from_default(self):
+        """ Секция месяца создается и при платежах этого месяца в секции DEFAULT, они переносятся в новую секцию """
+
+        month = date(2100, 1, 1)
+        Payment.objects.create(payment_date='2100-01-15T10:00:00Z', course=self.course, amount=500,
+                               payment_method='CASH', owner=self.user)
+        self.assertNotIn(month, get_partitions(connection))
+
+        create_partition(connection, month)
+        out = StringIO()
+        call_command('ensure_payment_partitions', stdout=out)
+
+        self.assertIn('Секции созданы', out.getvalue())
+        self.assertEqual(get_partitions(connection)[month], get_partition_name(month))
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT "amount" FROM {connection.ops.quote_name(get_partition_name(month))}')
+            self.assertEqual(cursor.fetchall(), [(500,)])
+            cursor.execute('SELECT count(*) FROM "main_payment_default"')
+            self.assertEqual(cursor.fetchone()[0], 0)
+        self.assertEqual(Payment.objects.count(), 5)
+
+
+class FlakyEmailBackend(locmem.EmailBackend):
+    """ Почтовый бэкенд для тестов: пока установлен флаг, отклоняет пачки писем после первой """
+
+    failing = False
+
+    def send_messages(self, messages):
+        if self.failing and mail.outbox:
+            raise SMTPException('Почтовый сервер недоступен')
+        return super().send_messages(messages)
+
+
+@override_settings(COURSE_NOTIFICATION_DELAY=0, COURSE_NOTIFICATION_BATCH_SIZE=2)
+class CourseNotificationTestCase(APITestCase):
+    """ Тестирование очереди уведомлений подписчиков об обновлении курса """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        for index in range(3):
+            subscriber = User.objects.create(email=f'subscriber{index}@test.com')
+            Subscription.objects.create(user=subscriber, course=self.course, is_subscribed=True)
+        unsubscribed = User.objects.create(email='unsubscribed@test.com')
+        Subscription.objects.create(user=unsubscribed, course=self.course, is_subscribed=False)
+
+    def test_edits_coalesced_and_sent_in_batches(self):
+        """ Несколько изменений курса объединяются в одно задание, письма получают только подписчики """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.description = 'NewTestCourseDescription'
+            self.course.save()
+            Lesson.objects.create(course=self.course, name='TestLesson', description='TestLessonDescription')
+
+        notification = CourseNotification.objects.get()
+        self.assertEqual(notification.status, CourseNotification.STATUS_PENDING)
+        self.assertEqual(notification.changes_count, 2)
+
+        out = StringIO()
+        call_command('send_course_notifications', once=True, stdout=out)
+
+        self.assertIn('Обработано заданий: 1, отправлено писем: 3', out.getvalue())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['subscriber0@test.com', 'subscriber1@test.com', 'subscriber2@test.com'])
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, CourseNotification.STATUS_DONE)
+        self.assertEqual(notification.sent_count, 3)
+
+        # После рассылки новое изменение создает новое задание
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+        self.assertEqual(CourseNotification.objects.filter(status=CourseNotification.STATUS_PENDING).count(), 1)
+
+    @override_settings(COURSE_NOTIFICATION_DELAY=60)
+    def test_notification_waits_for_delay(self):
+        """ Рассылка не начинается до истечения задержки после последнего изменения """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(CourseNotification.objects.get().status, CourseNotification.STATUS_PENDING)
+
+    @override_settings(COURSE_NOTIFICATION_DELAY=60, COURSE_NOTIFICATION_MAX_DELAY=120)
+    def test_delay_capped_from_creation(self):
+        """ Новые изменения откладывают рассылку не дальше наибольшей задержки от создания задания """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+        created_at = timezone.now() - timedelta(seconds=100)
+        CourseNotification.objects.update(created_at=created_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+
+        notification = CourseNotification.objects.get()
+        self.assertEqual(notification.changes_count, 2)
+        self.assertEqual(notification.scheduled_at, created_at + timedelta(seconds=120))
+
+    @override_settings(EMAIL_BACKEND=f'{__name__}.FlakyEmailBackend', COURSE_NOTIFICATION_MAX_ATTEMPTS=2,
+                       COURSE_NOTIFICATION_RETRY_DELAY=0)
+    def test_failed_notification_retried_after_last_recipient(self):
+        """ Задание с ошибкой повторяется с первого неотправленного письма, пока не исчерпаны попытки """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+
+        FlakyEmailBackend.failing = True
+        self.addCleanup(setattr, FlakyEmailBackend, 'failing', False)
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+
+        notification = CourseNotification.objects.get()
+        self.assertEqual(notification.status, CourseNotification.STATUS_FAILED)
+        self.assertEqual(notification.error, 'Почтовый сервер недоступен')
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.sent_count, 2)
+        self.assertEqual(notification.last_email, 'subscriber1@test.com')
+
+        FlakyEmailBackend.failing = False
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+
+        self.assertEqual([message.to[0] for message in mail.outbox],
+                         ['subscriber0@test.com', 'subscriber1@test.com', 'subscriber2@test.com'])
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, CourseNotification.STATUS_DONE)
+        self.assertEqual(notification.attempts, 2)
+        self.assertEqual(notification.sent_count, 3)
+
+        # Исчерпавшее попытки задание с ошибкой больше не захватывается
+        CourseNotification.objects.update(status=CourseNotification.STATUS_FAILED)
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+
+    @override_settings(COURSE_NOTIFICATION_CLAIM_TIMEOUT=60, COURSE_NOTIFICATION_MAX_ATTEMPTS=2)
+    def test_abandoned_notification_reclaimed(self):
+        """ Задание, брошенное обработчиком, захватывается повторно после таймаута, пока не исчерпаны попытки """
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.save()
+        claim_due_notifications(limit=1)
+
+        # Задание в обработке до истечения таймаута не захватывается
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        CourseNotification.objects.update(claimed_at=timezone.now() - timedelta(seconds=61))
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 3)
+        notification = CourseNotification.objects.get()
+        self.assertEqual(notification.status, CourseNotification.STATUS_DONE)
+        self.assertEqual(notification.attempts, 2)
+
+        # Брошенное задание без оставшихся попыток завершается с ошибкой
+        CourseNotification.objects.update(status=CourseNotification.STATUS_PROCESSING,
+                                          claimed_at=timezone.now() - timedelta(seconds=61))
+        call_command('send_course_notifications', once=True, stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 3)
+        notification.refresh_from_db()
+        self.assertEqual(notification.status, CourseNotification.STATUS_FAILED)
+        self.assertEqual(notification.error, 'Обработчик не завершил рассылку')
+
+
+class ContentHashMigrationTestCase(TransactionTestCase):
+    """ Тестирование миграции уникальности названия и описания при повторах в существующих данных """
+
+    migrate_from = [('main', '0011_course_content_hash_lesson_content_hash')]
+    migrate_to = [('main', '0012_content_hash_unique')]
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, откат схемы до миграции с заполнением хэшей """
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        self.apps = executor.loader.project_state(self.migrate_from).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_are_reported(self):
+        """ Повторяющиеся курсы останавливают миграцию до добавления ограничений, в ошибке перечислены их id """
+
+        Course = self.apps.get_model('main', 'Course')
+        content_hash = make_content_hash('TestCourse', 'TestCourseDescription')
+        first, second = (Course.objects.create(name='TestCourse', description='TestCourseDescription',
+                                               content_hash=content_hash) for _ in range(2))
+        Course.objects.create(name='OtherCourse', description='TestCourseDescription',
+                              content_hash=make_content_hash('OtherCourse', 'TestCourseDescription'))
+
+        executor = MigrationExecutor(connection)
+        with self.assertRaisesMessage(RuntimeError, f'Course: id {first.pk}, {second.pk}'):
+            executor.migrate(self.migrate_to)
+
+        Course.objects.filter(pk=second.pk).update(description='Changed',
+                                                   content_hash=make_content_hash('TestCourse', 'Changed'))
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
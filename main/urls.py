@@ -2,9 +2,9 @@ from main.apps import MainConfig
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from main.views import CourseViewSet, LessonCreateAPIView, LessonListAPIView, LessonRetrieveAPIView, \
+from main.views import CourseViewSet, LessonBulkAPIView, LessonCreateAPIView, LessonListAPIView, LessonRetrieveAPIView, \
     LessonUpdateAPIView, LessonDestroyAPIView, PaymentRetrieveAPIView, PaymentListAPIView, PaymentCreateAPIView, \
-    SubscriptionViewSet
+    PaymentExportAPIView, PaymentRevenueAPIView, SubscriptionViewSet
 
 app_name = MainConfig.name
 
@@ -18,6 +18,7 @@ router.register(r'subscription', SubscriptionViewSet, basename='subscription')
 
 urlpatterns = [
     path('lesson/create/', LessonCreateAPIView.as_view(), name='lesson_create'),
+    path('lesson/bulk/', LessonBulkAPIView.as_view(), name='lesson_bulk'),
     path('lesson/', LessonListAPIView.as_view(), name='lesson_list'),
     path('lesson/<int:pk>/detail/', LessonRetrieveAPIView.as_view(), name='lesson_detail'),
     path('lesson/<int:pk>/update/', LessonUpdateAPIView.as_view(), name='lesson_update'),
@@ -26,4 +27,6 @@ urlpatterns = [
     path('payments/', PaymentListAPIView.as_view(), name='payments_list'),
     path('payments/<int:pk>/', PaymentRetrieveAPIView.as_view(), name='payments_get'),
     path('payments/create/', PaymentCreateAPIView.as_view(), name='payments_create'),
+    path('payments/export/<str:file_format>/', PaymentExportAPIView.as_view(), name='payments_export'),
+    path('payments/revenue/', PaymentRevenueAPIView.as_view(), name='payments_revenue'),
 ] + router.urls
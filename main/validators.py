@@ -1,24 +1,97 @@
 import re
+from functools import lru_cache
+
+from django.conf import settings
 from rest_framework.serializers import ValidationError
 
+from main.models import make_content_hash
+
+
+class LinkScanner:
+    """
+    Однопроходный поиск ссылок в тексте с проверкой хоста по списку разрешенных доменов:
+    разрешен сам домен из списка и любые его поддомены
+    """
+
+    # Необязательная схема и хост из меток через точку. Шаблон компилируется один раз при импорте,
+    # начинается только на границе слова и не откатывается внутри меток (притяжательные квантификаторы)
+    LINK_PATTERN = re.compile(r'(?<![\w-])(https?://)?([\w-]++(?:\.[\w-]++)+)', re.IGNORECASE)
+
+    def __init__(self, allowed_domains):
+        self.allowed_domains = frozenset(domain.strip().lower().lstrip('.') for domain in allowed_domains)
+
+    def is_allowed_host(self, host):
+        """ Точное совпадение хоста или любого его суффикса по границе меток с доменом из списка """
+
+        host = host.lower()
+        while '.' in host:
+            if host in self.allowed_domains:
+                return True
+            host = host.partition('.')[2]
+        return False
+
+    def find_external_link(self, text):
+        """ Первый хост, не входящий в список разрешенных, или None """
+
+        for match in self.LINK_PATTERN.finditer(text):
+            scheme, host = match.groups()
+            # Без схемы "3.14" или "v1.2" ссылкой не считаем: домен верхнего уровня состоит из букв
+            if scheme is None and not host.rsplit('.', 1)[-1].isalpha():
+                continue
+            if not self.is_allowed_host(host):
+                return host
+        return None
+
+
+@lru_cache(maxsize=None)
+def get_link_scanner(allowed_domains):
+    """ Сканер для набора доменов создается один раз и переиспользуется всеми сериализаторами """
+
+    return LinkScanner(allowed_domains)
+
 
 class LinkValidator:
-    """Валидация ссылки на материалы (только youtube) """
+    """Валидация ссылок на материалы: разрешены только домены из LINK_VALIDATOR_ALLOWED_DOMAINS """
 
-    def __init__(self, fields):
+    def __init__(self, fields, allowed_domains=None):
         self.fields = fields
+        self.allowed_domains = allowed_domains
 
     def __call__(self, value):
         for field in self.fields:
-            text = value.get(field, '')
+            text = value.get(field) or ''
             if self.has_external_links(text):
                 raise ValidationError('Недопустимая ссылка на сторонний ресурс!')
 
+    @property
+    def scanner(self):
+        allowed_domains = self.allowed_domains or settings.LINK_VALIDATOR_ALLOWED_DOMAINS
+        return get_link_scanner(tuple(allowed_domains))
+
     def has_external_links(self, text):
-        """ Определяем метод, позволяющий фильтровать ссылки и не пропускать, кроме youtube """
+        """ Определяем метод, позволяющий фильтровать ссылки и не пропускать, кроме разрешенных доменов """
 
-        urls = re.findall(r'(?:https?://|www\.)?([^\s./?#]+)(?:\.[^\s./?#]+)', text)
-        for url in urls:
-            if 'youtube' not in url:
-                return True
-        return False
\ No newline at end of file
+        return self.scanner.find_external_link(text) is not None
+
+
+class ContentHashUniqueValidator:
+    """ Проверка уникальности пары (name, description) по индексированному хэшу вместо сравнения текста """
+
+    requires_context = True
+    message = 'Поля name, description должны составлять уникальный набор.'
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __call__(self, attrs, serializer):
+        instance = serializer.instance
+        name = attrs.get('name', getattr(instance, 'name', None))
+        description = attrs.get('description', getattr(instance, 'description', None))
+        if name is None or description is None:
+            return
+
+        queryset = self.queryset.filter(content_hash=make_content_hash(name, description))
+        if instance is not None:
+            queryset = queryset.exclude(pk=instance.pk)
+        if queryset.exists():
+            raise ValidationError(self.message, code='unique')
@@ -1,40 +1,51 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce, TruncMonth
 from rest_framework import viewsets, generics
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import OrderingFilter
-from rest_framework.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.permissions import IsAuthenticated
-
-from main.paginators import EducationPaginator
-from main.permissions import IsModeratorOrReadOnly, IsCourseOrLessonOwner, IsPaymentOwner, IsCourseOwner
-
-from main.models import Course, Lesson, Payment, Subscription
-from main.serializers import CourseSerializer, LessonSerializer, PaymentSerializer, SubscriptionSerializer
+from rest_framework.response import Response
+
+from main.cache import get_user_scope, invalidate_scopes
+from main.filters import PaymentRevenueFilter
+from main.mixins import CachedResponseMixin, ConditionalGetMixin, IdempotencyKeyMixin, RoleScopedQuerysetMixin
+from main.paginators import ApproximateCountPaginator, EducationPaginator, PaginationModeMixin, \
+    PaymentCursorPaginator
+from main.permissions import IsModerator, IsModeratorOrReadOnly, IsCourseOrLessonOwner, IsPaymentOwner, \
+    IsCourseOwner
+
+from main.models import Course, Lesson, Payment, PaymentDailyRollup, Subscription
+from main.serializers import CourseSerializer, LessonBulkItemSerializer, LessonSerializer, PaymentSerializer, \
+    SubscriptionSerializer, SubscriptionToggleSerializer, parse_list_param
 from users.models import UserRoles
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(ConditionalGetMixin, CachedResponseMixin, RoleScopedQuerysetMixin, PaginationModeMixin, viewsets.ModelViewSet):
     """ViewSet для модели обучающего курса"""
+    queryset = Course.objects.order_by('pk')
     serializer_class = CourseSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOwner]
-    pagination_class = EducationPaginator
-
-    def get_queryset(self):
-        """Переопределяем queryset, чтобы доступ к обьекту имели только его владельцы и модератор"""
-
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Course.objects.all()
-        else:
-            return Course.objects.filter(owner=self.request.user)
+    pagination_class = ApproximateCountPaginator
+    # is_subscribed в ответе меняется без изменения updated_at курса: детали проверяются только по ETag,
+    # который учитывает версию подписок пользователя
+    conditional_last_modified = False
 
     def perform_create(self, serializer):
         """Переопределяем метод создания обьекта с условием, чтобы модераторы не могли создавать обьект"""
 
         if self.request.user.role == UserRoles.MODERATOR:
             raise PermissionDenied("Вы не можете создавать новые курсы!")
-        else:
-            new_payment = serializer.save()
-            new_payment.owner = self.request.user
-            new_payment.save()
+        # Владелец передается в save(): курс записывается одним запросом, и сигналы сразу видят итогового владельца
+        # (повторное сохранение считалось изменением курса и ставило в очередь рассылку подписчикам)
+        serializer.save(owner=self.request.user)
 
     def perform_destroy(self, instance):
         """Переопределяем метод удаления обьекта с условием, чтобы модераторы не могли удалять обьект"""
@@ -54,66 +65,60 @@ class LessonCreateAPIView(generics.CreateAPIView):
 
         if self.request.user.role == UserRoles.MODERATOR:
             raise PermissionDenied("Вы не можете создать новый урок!")
-        new_lesson = serializer.save()
-        new_lesson.owner = self.request.user
-        new_lesson.save()
+        serializer.save(owner=self.request.user)
 
 
-class LessonListAPIView(generics.ListAPIView):
-    """Generic-класс для просмотра всех объектов Lesson"""
-    serializer_class = LessonSerializer
-    permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
-    pagination_class = EducationPaginator
+class LessonBulkAPIView(RoleScopedQuerysetMixin, generics.CreateAPIView):
+    """Generic-класс для пакетного создания и обновления уроков одним запросом"""
+    queryset = Lesson.objects.all()
+    serializer_class = LessonBulkItemSerializer
+    permission_classes = [IsAuthenticated]
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
+    def get_serializer(self, *args, **kwargs):
+        kwargs['many'] = True
+        kwargs['allow_empty'] = False
+        return super().get_serializer(*args, **kwargs)
 
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
-        else:
-            return Lesson.objects.filter(owner=self.request.user)
+    def perform_create(self, serializer):
+        """ Модераторы могут обновлять уроки пакетом, но не создавать новые """
 
+        if self.request.user.role == UserRoles.MODERATOR and any(
+                'id' not in item for item in serializer.validated_data):
+            raise PermissionDenied("Вы не можете создать новый урок!")
+        serializer.save()
 
-class LessonRetrieveAPIView(generics.RetrieveAPIView):
-    """Generic-класс для просмотра одного объекта Lesson"""
+
+class LessonListAPIView(ConditionalGetMixin, RoleScopedQuerysetMixin, PaginationModeMixin, generics.ListAPIView):
+    """Generic-класс для просмотра всех объектов Lesson"""
+    queryset = Lesson.objects.order_by('pk')
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
+    pagination_class = ApproximateCountPaginator
+    # Урок выводит название курса, поэтому переименование курса тоже меняет ответ
+    last_modified_fields = ('updated_at', 'course__updated_at')
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
 
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
-        else:
-            return Lesson.objects.filter(owner=self.request.user)
+class LessonRetrieveAPIView(ConditionalGetMixin, CachedResponseMixin, RoleScopedQuerysetMixin, generics.RetrieveAPIView):
+    """Generic-класс для просмотра одного объекта Lesson"""
+    queryset = Lesson.objects.all()
+    serializer_class = LessonSerializer
+    permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
+    # Урок выводит название курса, поэтому переименование курса тоже меняет ответ
+    last_modified_fields = ('updated_at', 'course__updated_at')
 
 
-class LessonUpdateAPIView(generics.UpdateAPIView):
+class LessonUpdateAPIView(RoleScopedQuerysetMixin, generics.UpdateAPIView):
     """Generic-класс для обновления объекта Lesson"""
+    queryset = Lesson.objects.all()
     serializer_class = LessonSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
-
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
-        else:
-            return Lesson.objects.filter(owner=self.request.user)
-
 
-class LessonDestroyAPIView(generics.DestroyAPIView):
+class LessonDestroyAPIView(RoleScopedQuerysetMixin, generics.DestroyAPIView):
     """Generic-класс для удаления одного объекта Lesson"""
+    queryset = Lesson.objects.all()
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsCourseOrLessonOwner]
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
-
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Lesson.objects.all()
-        else:
-            return Lesson.objects.filter(owner=self.request.user)
-
     def perform_destroy(self, instance):
         """ Переопределяем метод удаления обьекта с условием, чтобы модераторы не могли удалять обьект """
 
@@ -122,29 +127,25 @@ class LessonDestroyAPIView(generics.DestroyAPIView):
         instance.delete()
 
 
-class PaymentListAPIView(generics.ListAPIView):
+class PaymentListAPIView(RoleScopedQuerysetMixin, PaginationModeMixin, generics.ListAPIView):
     """ Generic-класс для вывода списка платежей """
 
+    queryset = Payment.objects.order_by('pk')
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
+    pagination_class = ApproximateCountPaginator
+    cursor_pagination_class = PaymentCursorPaginator
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     # Определяем фильтрацию по нужным нам полям
     filterset_fields = ('course', 'lesson', 'owner', 'payment_method',)
     # Определяем фильтрацию по дате
     ordering_fields = ('payment_date',)
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
-
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Payment.objects.all()
-        else:
-            return Payment.objects.filter(owner=self.request.user)
 
-
-class PaymentRetrieveAPIView(generics.RetrieveAPIView):
+class PaymentRetrieveAPIView(RoleScopedQuerysetMixin, generics.RetrieveAPIView):
     """ Generic-класс для просмотра платежа """
 
+    queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsModeratorOrReadOnly | IsPaymentOwner]
     filter_backends = [DjangoFilterBackend, OrderingFilter]
@@ -153,17 +154,111 @@ class PaymentRetrieveAPIView(generics.RetrieveAPIView):
     # Определяем фильтрацию по дате
     ordering_fields = ('payment_date',)
 
-    def get_queryset(self):
-        """ Переопределяем queryset чтобы доступ к обьекту имели только его владельцы и модератор """
 
-        if self.request.user.role == UserRoles.MODERATOR:
-            return Payment.objects.all()
-        else:
-            return Payment.objects.filter(owner=self.request.user)
+class EchoBuffer:
+    """ Буфер для csv.writer, возвращающий записанную строку вместо ее накопления """
+
+    def write(self, value):
+        return value
 
 
-class PaymentCreateAPIView(generics.CreateAPIView):
-    """ Generic - класс для создания нового платежа """
+class PaymentExportAPIView(RoleScopedQuerysetMixin, generics.GenericAPIView):
+    """
+    Generic-класс для потоковой выгрузки платежей в CSV или NDJSON с теми же фильтрами, что и у списка платежей.
+    Строки читаются из БД порциями через серверный курсор и сразу отдаются клиенту
+    """
+
+    queryset = Payment.objects.order_by('pk')
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ('course', 'lesson', 'owner', 'payment_method',)
+    ordering_fields = ('payment_date',)
+    # Колонки выгрузки и поля модели, названия курса, урока и почта владельца берутся JOIN-ом
+    export_fields = {
+        'id': 'id',
+        'payment_date': 'payment_date',
+        'amount': 'amount',
+        'payment_method': 'payment_method',
+        'course': 'course__name',
+        'lesson': 'lesson__name',
+        'owner': 'owner__email',
+    }
+    chunk_size = 2000
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    def get(self, request, file_format, *args, **kwargs):
+        if file_format not in self.content_types:
+            raise NotFound(f'Формат выгрузки {file_format} не поддерживается.')
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values_list(*self.export_fields.values()).iterator(chunk_size=self.chunk_size)
+
+        lines = self.get_csv_lines(rows) if file_format == 'csv' else self.get_ndjson_lines(rows)
+        response = StreamingHttpResponse(lines, content_type=self.content_types[file_format])
+        response['Content-Disposition'] = f'attachment; filename="payments.{file_format}"'
+        return response
+
+    def get_csv_lines(self, rows):
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(self.export_fields)
+        for row in rows:
+            yield writer.writerow(row)
+
+    def get_ndjson_lines(self, rows):
+        names = list(self.export_fields)
+        for row in rows:
+            yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+class PaymentRevenueAPIView(generics.GenericAPIView):
+    """
+    Generic-класс для вывода выручки по дневным итогам платежей.
+    ?group_by=date,month,course,lesson,payment_method задает группировку, суммирование выполняется в БД
+    """
+
+    queryset = PaymentDailyRollup.objects.all()
+    permission_classes = [IsAuthenticated, IsModerator]
+    pagination_class = None
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = PaymentRevenueFilter
+    # Поля группировки и дополнительные выводимые поля для каждого из них
+    group_by_fields = {
+        'date': {},
+        'month': {'month': TruncMonth('date')},
+        'course': {'course_name': F('course__name')},
+        'lesson': {'lesson_name': F('lesson__name')},
+        'payment_method': {},
+    }
+
+    def get_group_by(self):
+        group_by = parse_list_param(self.request.query_params.get('group_by'))
+        unknown = group_by - set(self.group_by_fields)
+        if unknown:
+            raise ValidationError({'group_by': [f'Недопустимые поля группировки: {", ".join(sorted(unknown))}.']})
+        return [name for name in self.group_by_fields if name in group_by]
+
+    def get(self, request, *args, **kwargs):
+        group_by = self.get_group_by()
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+        totals = {'total_amount': Coalesce(Sum('amount'), 0), 'payments_count': Coalesce(Sum('count'), 0)}
+        if not group_by:
+            return Response([queryset.aggregate(**totals)])
+
+        columns = []
+        for name in group_by:
+            extra = self.group_by_fields[name]
+            queryset = queryset.annotate(**extra)
+            columns.extend(dict.fromkeys([name, *extra]))
+        revenue = queryset.values(*columns).annotate(**totals)
+        # Группы, все платежи которых были удалены или перенесены, не выводим
+        revenue = revenue.filter(payments_count__gt=0).order_by(*group_by)
+        return Response(list(revenue))
+
+
+class PaymentCreateAPIView(IdempotencyKeyMixin, generics.CreateAPIView):
+    """ Generic - класс для создания нового платежа, повторы запроса с заголовком Idempotency-Key не создают дублей """
 
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsPaymentOwner]
@@ -173,21 +268,46 @@ class PaymentCreateAPIView(generics.CreateAPIView):
 
         if self.request.user.role == UserRoles.MODERATOR:
             raise PermissionDenied("Вы не можете создавать новые платежи!")
-        else:
-            new_payment = serializer.save()
-            new_payment.owner = self.request.user
-            new_payment.save()
+        serializer.save(owner=self.request.user)
 
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(RoleScopedQuerysetMixin, PaginationModeMixin, viewsets.ModelViewSet):
     """ ViewSet - набор основных CRUD действий над подписками на курсы """
 
     serializer_class = SubscriptionSerializer
-    queryset = Subscription.objects.all()
+    # Пользователь видит только свои подписки, модератор - все
+    queryset = Subscription.objects.order_by('pk')
+    owner_field = 'user'
+    permission_classes = [IsAuthenticated]
+    pagination_class = EducationPaginator
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ('is_subscribed',)
     lookup_field = 'id'
 
     def perform_create(self, serializer):
-        """ Переопределение метода создания подписки, чтобы сохранять текущий статус подписки True или False """
-
-        new_subscription = serializer.save(user=self.request.user)  # Сохраняем связь пользователя
-        new_subscription.save()
+        """ Переопределение метода создания подписки, чтобы сохранять подписку от имени текущего пользователя """
+
+        serializer.save(user=self.request.user)
+
+    @action(detail=False, methods=['post'], serializer_class=SubscriptionToggleSerializer)
+    def toggle(self, request, *args, **kwargs):
+        """ Подписка на курс или отписка от него одним запросом INSERT ... ON CONFLICT DO UPDATE """
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        course = serializer.validated_data['course']
+
+        quote_name = connection.ops.quote_name
+        table = quote_name(Subscription._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ("user_id", "course_id", "is_subscribed") VALUES (%s, %s, %s) '
+                f'ON CONFLICT ("user_id", "course_id") DO UPDATE SET "is_subscribed" = NOT {table}."is_subscribed" '
+                f'RETURNING "id", "is_subscribed"',
+                [request.user.pk, course.pk, True],
+            )
+            subscription_id, is_subscribed = cursor.fetchone()
+        # Запрос идет мимо ORM, поэтому сигналы не срабатывают и кэш ответов подписчика сбрасываем сами
+        invalidate_scopes(get_user_scope(request.user.pk))
+        return Response({'id': subscription_id, 'user': request.user.pk, 'course': course.pk,
+                         'is_subscribed': bool(is_subscribed)})
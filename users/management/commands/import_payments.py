@@ -0,0 +1,221 @@
+import csv
+import io
+import json
+import os
+import time
+from collections import defaultdict
+from itertools import islice
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main.models import Course, Lesson, Payment, PaymentDailyRollup
+from users.models import User
+
+PAYMENT_METHODS = {method for method, _ in Payment.METHOD_CHOICES}
+COPY_COLUMNS = ('payment_date', 'amount', 'payment_method', 'course', 'lesson', 'owner')
+# Количество номеров пропущенных записей в отчете
+REPORT_LIMIT = 10
+
+
+# Значение ссылки, которому соответствует несколько объектов
+AMBIGUOUS = object()
+
+
+class LookupMap:
+    """
+    Кэш ссылок вида (значения полей) -> id, недостающие значения загружаются одним запросом на пачку строк.
+    Если значениям соответствует несколько объектов (например, одинаковые названия курсов), ссылка неоднозначна
+    """
+
+    def __init__(self, queryset, *fields):
+        self.queryset = queryset
+        self.fields = fields
+        self.ids = {}
+
+    def load(self, keys):
+        missing = {key for key in keys if all(key) and key not in self.ids}
+        if missing:
+            lookups = {f'{field}__in': {key[index] for key in missing} for index, field in enumerate(self.fields)}
+            found = {}
+            for *key, pk in self.queryset.filter(**lookups).values_list(*self.fields, 'pk'):
+                key = tuple(key)
+                found[key] = AMBIGUOUS if key in found else pk
+            # Условия по полям отдельно могут захватить лишние сочетания, берем только запрошенные
+            self.ids.update((key, found[key]) for key in missing if key in found)
+            # Не найденные значения тоже запоминаем, чтобы не запрашивать их повторно
+            self.ids.update({key: None for key in missing if key not in found})
+
+    def get(self, *key):
+        return self.ids.get(key) if all(key) else None
+
+
+class SkippedRecords:
+    """ Количество пропущенных записей и номера первых REPORT_LIMIT из них для отчета """
+
+    def __init__(self):
+        self.count = 0
+        self.first = []
+
+    def add(self, line):
+        self.count += 1
+        if len(self.first) < REPORT_LIMIT:
+            self.first.append(line)
+
+    def __str__(self):
+        return f'{self.count}, первые: {", ".join(map(str, self.first))}'
+
+
+class Command(BaseCommand):
+    """Команда для массового импорта платежей из CSV или NDJSON"""
+
+    help = 'Импортирует платежи из файла CSV или NDJSON (колонки как у выгрузки payments/export/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с платежами')
+        parser.add_argument('--format', choices=('csv', 'ndjson'), help='Формат файла, по умолчанию - по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Количество платежей в одной вставке')
+        parser.add_argument('--no-copy', action='store_true', help='Не использовать COPY в PostgreSQL')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in ('csv', 'ndjson'):
+            raise CommandError('Укажите формат файла: --format csv или --format ndjson')
+        use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+
+        self.courses = LookupMap(Course.objects.all(), 'name')
+        # Урок ищется по названию внутри курса записи, а без курса - по названию среди всех уроков
+        self.course_lessons = LookupMap(Lesson.objects.all(), 'course_id', 'name')
+        self.lessons = LookupMap(Lesson.objects.all(), 'name')
+        self.owners = LookupMap(User.objects.all(), 'email')
+        self.skipped = SkippedRecords()
+        self.ambiguous = SkippedRecords()
+
+        imported = 0
+        started = time.perf_counter()
+        with open(options['path'], encoding='utf-8', newline='') as file:
+            if file_format == 'csv':
+                records = enumerate(csv.DictReader(file), start=1)
+            else:
+                records = self.read_ndjson(file)
+            while batch := list(islice(records, options['batch_size'])):
+                payments = self.resolve(batch)
+                with transaction.atomic():
+                    if use_copy:
+                        self.copy_payments(payments)
+                    else:
+                        Payment.objects.bulk_create(payments)
+                    self.add_rollups(payments)
+                imported += len(payments)
+                elapsed = max(time.perf_counter() - started, 1e-9)
+                self.stdout.write(f'Импортировано платежей: {imported} ({imported / elapsed:.0f} строк/с)')
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        if self.skipped.count:
+            self.stdout.write(self.style.WARNING(f'Пропущено записей: {self.skipped}'))
+        if self.ambiguous.count:
+            self.stdout.write(self.style.WARNING(
+                f'Из них с неоднозначным курсом или уроком (несколько объектов с таким названием): {self.ambiguous}'
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано платежей: {imported} за {elapsed:.1f} с ({imported / elapsed:.0f} строк/с)'
+        ))
+
+    @staticmethod
+    def read_ndjson(file):
+        """
+        Записи NDJSON с номерами. Строка с некорректным JSON или не объектом заменяется пустой записью:
+        она пропускается при разборе пачки и попадает в отчет, как и записи с некорректными данными
+        """
+
+        lines = (line for line in file if line.strip())
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                record = None
+            yield number, record if isinstance(record, dict) else {}
+
+    def resolve(self, batch):
+        """ Разбор пачки записей в платежи, ссылки на курсы, уроки и владельцев загружаются одним запросом на модель """
+
+        self.courses.load((record.get('course'),) for _, record in batch)
+        self.owners.load((record.get('owner'),) for _, record in batch)
+        course_ids = [self.courses.get(record.get('course')) for _, record in batch]
+        self.course_lessons.load(
+            (course_id, record.get('lesson')) for course_id, (_, record) in zip(course_ids, batch)
+            if course_id is not AMBIGUOUS
+        )
+        self.lessons.load((record.get('lesson'),) for _, record in batch if not record.get('course'))
+
+        payments = []
+        for course_id, (line, record) in zip(course_ids, batch):
+            payment_date = parse_datetime(str(record.get('payment_date') or ''))
+            if record.get('course'):
+                lesson_id = None if course_id is AMBIGUOUS else self.course_lessons.get(course_id, record.get('lesson'))
+            else:
+                lesson_id = self.lessons.get(record.get('lesson'))
+            owner_id = self.owners.get(record.get('owner'))
+            if AMBIGUOUS in (course_id, lesson_id):
+                self.skipped.add(line)
+                self.ambiguous.add(line)
+                continue
+            unresolved = any(record.get(name) and value is None for name, value in
+                             (('course', course_id), ('lesson', lesson_id), ('owner', owner_id)))
+            try:
+                amount = int(record.get('amount'))
+            except (TypeError, ValueError):
+                amount = None
+            if payment_date is None or amount is None or amount < 0 or unresolved \
+                    or record.get('payment_method') not in PAYMENT_METHODS:
+                self.skipped.add(line)
+                continue
+            if timezone.is_naive(payment_date):
+                payment_date = timezone.make_aware(payment_date)
+            payments.append(Payment(payment_date=payment_date, amount=amount, payment_method=record['payment_method'],
+                                    course_id=course_id, lesson_id=lesson_id, owner_id=owner_id))
+        return payments
+
+    @staticmethod
+    def copy_payments(payments):
+        """ Вставка пачки платежей через COPY ... FROM STDIN (psycopg 3 или psycopg2) """
+
+        columns = ', '.join(connection.ops.quote_name(Payment._meta.get_field(name).column) for name in COPY_COLUMNS)
+        sql = f'COPY {connection.ops.quote_name(Payment._meta.db_table)} ({columns}) FROM STDIN'
+        rows = [
+            (payment.payment_date, payment.amount, payment.payment_method, payment.course_id, payment.lesson_id,
+             payment.owner_id)
+            for payment in payments
+        ]
+        with connection.cursor() as cursor:
+            driver_cursor = cursor.cursor
+            if hasattr(driver_cursor, 'copy'):
+                with driver_cursor.copy(sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                driver_cursor.copy_expert(f'{sql} WITH (FORMAT csv)', buffer)
+
+    @staticmethod
+    def add_rollups(payments):
+        """
+        Дневные итоги импортированных платежей: сигналы при массовой вставке не срабатывают,
+        поэтому итоги пачки добавляются отдельными строками одной вставкой
+        """
+
+        totals = defaultdict(lambda: [0, 0])
+        for payment in payments:
+            group = (timezone.localdate(payment.payment_date), payment.course_id, payment.lesson_id,
+                     payment.payment_method)
+            totals[group][0] += payment.amount
+            totals[group][1] += 1
+        PaymentDailyRollup.objects.bulk_create(
+            PaymentDailyRollup(date=date, course_id=course_id, lesson_id=lesson_id, payment_method=payment_method,
+                               amount=amount, count=count)
+            for (date, course_id, lesson_id, payment_method), (amount, count) in totals.items()
+        )
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2023-10-19 12:10
+
+from django.db import migrations, models
+import main.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_user_role'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, storage=main.storage.ContentAddressedStorage(), upload_to='users', verbose_name='Аватар'),
+        ),
+    ]
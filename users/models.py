@@ -2,6 +2,8 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from main.storage import content_addressed_storage
+
 NULLABLE = {
     'null': True,
     'blank': True
@@ -21,7 +23,8 @@ class User(AbstractUser):
     email = models.EmailField(max_length=30, unique=True, verbose_name='Почта')
     phone = models.CharField(max_length=20, verbose_name='Телефон', **NULLABLE)
     city = models.CharField(max_length=20, verbose_name='Город', **NULLABLE)
-    avatar = models.ImageField(upload_to='users', verbose_name='Аватар', **NULLABLE)
+    avatar = models.ImageField(upload_to='users', storage=content_addressed_storage, verbose_name='Аватар',
+                               **NULLABLE)
     role = models.CharField(max_length=9, choices=UserRoles.choices, default=UserRoles.MEMBER)
 
     USERNAME_FIELD = "email"
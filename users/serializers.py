@@ -1,26 +1,47 @@
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
 from rest_framework import serializers
 
 from main.models import Payment
-from main.serializers import PaymentForOwnerSerializer
+from main.serializers import ImageRenditionsField, PaymentForOwnerSerializer
 from users.models import User
 
 
 class UserSerializer(serializers.ModelSerializer):
     """ Сериализотор для модели пользователей """
 
-    # Расширяем сериализатор дополнительным вложенным полем с платежами
+    # Расширяем сериализатор дополнительным вложенным полем с последними платежами
     payments = serializers.SerializerMethodField()
+    # Количество и сумма всех платежей пользователя
+    payments_summary = serializers.SerializerMethodField()
+    # Уменьшенные копии аватара
+    avatar_renditions = ImageRenditionsField(source='avatar')
 
     class Meta:
         model = User
         fields = '__all__'
 
-    # Получаем все поля для дополнительного поля платежей с фильтрацией по пользователю
+    def is_profile_owner(self, owner):
+        # Если текущий пользователь не является владельцем профиля, то платежи не отображаются
+        return self.context['request'].user == owner
+
+    # Получаем последние USER_RECENT_PAYMENTS_COUNT платежей, полная история выводится постранично в user/payments/
     def get_payments(self, owner):
-        # Если текущий пользователь не является владельцем профиля, то история платежей не отображается
-        if self.context['request'].user != owner:
+        if not self.is_profile_owner(owner):
+            return None
+        payments = Payment.objects.filter(owner=owner).order_by('-payment_date', '-pk').only(
+            *PaymentForOwnerSerializer.Meta.fields
+        )[:settings.USER_RECENT_PAYMENTS_COUNT]
+        return PaymentForOwnerSerializer(payments, many=True).data
+
+    # Итоги по всем платежам считаются агрегатом в БД
+    def get_payments_summary(self, owner):
+        if not self.is_profile_owner(owner):
             return None
-        return PaymentForOwnerSerializer(Payment.objects.filter(owner=owner), many=True).data
+        return Payment.objects.filter(owner=owner).aggregate(
+            count=Count('pk'), total_amount=Coalesce(Sum('amount'), 0),
+        )
 
 
 class PublicUserSerializer(serializers.ModelSerializer):
@@ -28,4 +49,4 @@ class PublicUserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'first_name', 'role']
\ No newline at end of file
+        fields = ['id', 'username', 'first_name', 'role']
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from main.cache import invalidate_users
+from main.images import register_image_renditions
+from users.models import User
+
+register_image_renditions(User, 'avatar')
+
+
+@receiver(post_init, sender=User)
+def remember_user_first_name(sender, instance, **kwargs):
+    """ Запоминаем имя пользователя при загрузке, чтобы отследить его изменение """
+
+    instance._loaded_first_name = instance.__dict__.get('first_name')
+
+
+@receiver(post_save, sender=User)
+def on_user_saved(sender, instance, created, raw=False, **kwargs):
+    """ Имя выводится владельцем в курсах пользователя: при его смене сбрасываем кэш пользователя и модераторов """
+
+    first_name = instance.__dict__.get('first_name')
+    if not raw and not created and first_name != instance._loaded_first_name:
+        invalidate_users(instance.pk)
+    instance._loaded_first_name = first_name
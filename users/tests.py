@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.reverse import reverse
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from main.models import Course, Lesson, Payment, PaymentDailyRollup
+from users.models import User
+from users.serializers import UserSerializer
+
+
+class ImportPaymentsTestCase(APITestCase):
+    """ Тестирование массового импорта платежей """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member@test.com', password='member')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        self.lesson = Lesson.objects.create(course=self.course, name='TestLesson', description='TestLessonDescription')
+
+    def write_file(self, suffix, content):
+        file = tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False)
+        self.addCleanup(os.remove, file.name)
+        with file:
+            file.write(content)
+        return file.name
+
+    def test_import_csv(self):
+        """ Платежи из CSV импортируются пачками, строки с неизвестными ссылками пропускаются """
+
+        path = self.write_file('.csv', '\n'.join([
+            'payment_date,amount,payment_method,course,lesson,owner',
+            '2023-10-01T10:00:00+00:00,100,CASH,TestCourse,TestLesson,member@test.com',
+            '2023-10-01 12:00:00,200,TRANSFER,TestCourse,,member@test.com',
+            '2023-10-02T10:00:00+00:00,300,CASH,TestCourse,,',
+            '2023-10-02T10:00:00+00:00,400,CASH,UnknownCourse,,member@test.com',
+            'not a date,500,CASH,,,',
+        ]))
+        out = StringIO()
+        call_command('import_payments', path, batch_size=2, stdout=out)
+
+        self.assertEqual(Payment.objects.count(), 3)
+        self.assertEqual(Payment.objects.filter(owner=self.user, course=self.course).count(), 2)
+        self.assertEqual(Payment.objects.get(amount=100).lesson, self.lesson)
+        self.assertIn('Пропущено записей: 2, первые: 4, 5', out.getvalue())
+        self.assertIn('строк/с', out.getvalue())
+
+        # Дневные итоги импортированных платежей совпадают с полным пересчетом
+        totals = PaymentDailyRollup.objects.aggregate(amount=Sum('amount'), count=Sum('count'))
+        self.assertEqual(totals, {'amount': 600, 'count': 3})
+        call_command('rebuild_payment_rollups', stdout=StringIO())
+        self.assertEqual(PaymentDailyRollup.objects.aggregate(amount=Sum('amount'), count=Sum('count')), totals)
+
+    def test_import_ndjson(self):
+        """ Платежи импортируются из NDJSON (формат - по расширению файла), строки с ошибкой JSON пропускаются """
+
+        records = [
+            {'payment_date': '2023-10-01T10:00:00+00:00', 'amount': 100, 'payment_method': 'CASH',
+             'course': 'TestCourse', 'lesson': None, 'owner': 'member@test.com'},
+            {'payment_date': '2023-10-03T10:00:00+00:00', 'amount': 150, 'payment_method': 'TRANSFER',
+             'course': None, 'lesson': 'TestLesson', 'owner': None},
+        ]
+        lines = [json.dumps(records[0]), '{"payment_date": ', '[1, 2]', json.dumps(records[1])]
+        path = self.write_file('.ndjson', '\n'.join(lines) + '\n')
+        out = StringIO()
+        call_command('import_payments', path, batch_size=2, stdout=out)
+
+        self.assertEqual(list(Payment.objects.order_by('amount').values_list('amount', 'course', 'lesson')),
+                         [(100, self.course.pk, None), (150, None, self.lesson.pk)])
+        self.assertIn('Пропущено записей: 2, первые: 2, 3', out.getvalue())
+
+    def test_lessons_matched_within_course(self):
+        """ Урок ищется внутри курса записи, записи с неоднозначными курсом или уроком пропускаются """
+
+        other_course = Course.objects.create(name='OtherCourse', description='TestCourseDescription')
+        other_lesson = Lesson.objects.create(course=other_course, name='TestLesson', description='OtherDescription')
+        Course.objects.create(name='DuplicateCourse', description='TestCourseDescription')
+        Course.objects.create(name='DuplicateCourse', description='OtherDescription')
+
+        path = self.write_file('.csv', '\n'.join([
+            'payment_date,amount,payment_method,course,lesson,owner',
+            '2023-10-01T10:00:00+00:00,100,CASH,TestCourse,TestLesson,',
+            '2023-10-01T10:00:00+00:00,200,CASH,OtherCourse,TestLesson,',
+            '2023-10-01T10:00:00+00:00,300,CASH,DuplicateCourse,,',
+            '2023-10-01T10:00:00+00:00,400,CASH,,TestLesson,',
+        ]))
+        out = StringIO()
+        call_command('import_payments', path, stdout=out)
+
+        self.assertEqual(list(Payment.objects.order_by('amount').values_list('amount', 'course', 'lesson')),
+                         [(100, self.course.pk, self.lesson.pk), (200, other_course.pk, other_lesson.pk)])
+        self.assertIn('Пропущено записей: 2, первые: 3, 4', out.getvalue())
+        self.assertIn('несколько объектов с таким названием): 2, первые: 3, 4', out.getvalue())
+
+
+class UserPaymentsTestCase(APITestCase):
+    """ Тестирование платежей в профиле пользователя """
+
+    def setUp(self):
+        """ Основные тестовые настройки для временной БД, создание экземпляров моделей """
+
+        self.user = User.objects.create(email='member', password='member')
+        self.other_user = User.objects.create(email='other', password='other')
+        self.course = Course.objects.create(name='TestCourse', description='TestCourseDescription', owner=self.user)
+        Payment.objects.bulk_create(
+            Payment(owner=self.user, course=self.course, amount=100 * index, payment_method='CASH',
+                    payment_date=timezone.now() - timedelta(days=index))
+            for index in range(1, 13)
+        )
+        Payment.objects.create(owner=self.other_user, course=self.course, amount=5000, payment_method='CASH',
+                               payment_date=timezone.now())
+
+    @override_settings(USER_RECENT_PAYMENTS_COUNT=3)
+    def test_profile_contains_recent_payments_and_summary(self):
+        """ В профиле - только последние платежи и итоги по всем платежам """
+
+        request = APIRequestFactory().get('/')
+        request.user = self.user
+        data = UserSerializer(self.user, context={'request': request}).data
+
+        self.assertEqual(
+            [payment['amount'] for payment in data['payments']],
+            [100, 200, 300]
+        )
+        self.assertEqual(
+            data['payments_summary'],
+            {'count': 12, 'total_amount': 7800}
+        )
+
+        request.user = self.other_user
+        data = UserSerializer(self.user, context={'request': request}).data
+
+        self.assertEqual(
+            (data['payments'], data['payments_summary']),
+            (None, None)
+        )
+
+    def test_payment_history_is_paginated(self):
+        """ Полная история платежей выводится постранично и только для текущего пользователя """
+
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get(reverse('users:payments'), {'page': 2})
+
+        self.assertEqual(
+            (response.json()['count'], [payment['amount'] for payment in response.json()['results']]),
+            (12, [1100, 1200])
+        )
+
+        response = self.client.get(reverse('users:payments'), {'pagination': 'cursor', 'per_page': 5})
+
+        self.assertEqual(
+            [payment['amount'] for payment in response.json()['results']],
+            [100, 200, 300, 400, 500]
+        )
@@ -1,5 +1,6 @@
 from django.urls import path
 from users.apps import UsersConfig
+from users.views import UserPaymentListAPIView
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -10,4 +11,5 @@ app_name = UsersConfig.name
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('payments/', UserPaymentListAPIView.as_view(), name='payments'),
 ]
\ No newline at end of file
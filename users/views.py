@@ -1,5 +1,8 @@
-from rest_framework import viewsets, permissions
+from rest_framework import generics, viewsets, permissions
 
+from main.models import Payment
+from main.paginators import EducationPaginator, PaginationModeMixin, PaymentCursorPaginator
+from main.serializers import PaymentForOwnerSerializer
 from users.models import User
 from users.permissions import IsOwnerOrReadOnly
 from users.serializers import UserSerializer, PublicUserSerializer
@@ -25,4 +28,18 @@ class UserViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         """ Позволяем создавать и редактировать только свой профиль """
 
-        serializer.save(owner=self.request.user)
\ No newline at end of file
+        serializer.save(owner=self.request.user)
+
+
+class UserPaymentListAPIView(PaginationModeMixin, generics.ListAPIView):
+    """ Generic-класс для постраничного вывода истории платежей текущего пользователя, начиная с новых """
+
+    serializer_class = PaymentForOwnerSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = EducationPaginator
+    cursor_pagination_class = PaymentCursorPaginator
+
+    def get_queryset(self):
+        return Payment.objects.filter(owner=self.request.user).order_by('-payment_date', '-pk').only(
+            *PaymentForOwnerSerializer.Meta.fields
+        )